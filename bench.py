@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+
+import argparse
+import asyncore
+import itertools
+import json
+import random
+import re
+import resource
+import shutil
+import smtpd
+import string
+import tempfile
+import threading
+import time
+
+from engine import Engine
+from fetch import FetchPool
+from matcher import KeywordMatcher
+from metrics import Metrics
+from notify import Notifier, SendQueue, SMTPSession
+from store import Store
+
+
+def _words(generator, count):
+    words = set()
+    while len(words) < count:
+        word = ''.join(generator.choice(string.ascii_lowercase) for _ in range(generator.randint(3, 8)))
+        if generator.random() < 0.2:
+            word += str(generator.randint(10, 9999))
+        words.add(word)
+    return sorted(words)
+
+
+def synthetic_requests(generator, keywords, subreddits, vocabulary):
+    """
+    Builds requests of one to three words spread over the subreddits' New listings.
+    :param generator: Seeded random generator
+    :param keywords: Number of requests
+    :param subreddits: Number of subreddits
+    :param vocabulary: Words to draw from
+    :return: Requests keyed the same way as the request table
+    """
+    requests = {}
+    for number in range(keywords):
+        keyword = u" ".join(generator.sample(vocabulary, generator.randint(1, 3)))
+        subreddit = u"sub{0}".format(number % subreddits)
+        requests[keyword + subreddit + u"New"] = keyword, subreddit, u"New"
+    return requests
+
+
+def synthetic_titles(generator, titles, vocabulary):
+    """
+    Builds titles of six to fourteen words with the punctuation and capitals of real post titles.
+    """
+    fillers = _words(generator, 2000)
+    result = []
+    for _ in range(titles):
+        words = [generator.choice(fillers) for _ in range(generator.randint(6, 14))]
+        if generator.random() < 0.05:
+            words[generator.randrange(len(words))] = generator.choice(vocabulary)
+        result.append(u"[{0}] {1} - ${2}".format(words[0].upper(), u" ".join(words[1:]), generator.randint(5, 999)))
+    return result
+
+
+def _regex_scan(requests, titles, subreddits):
+    # The matching the worker did before the index: every word of every keyword is searched for in every title.
+    matches = 0
+    for number, title in enumerate(titles):
+        subreddit = u"sub{0}".format(number % subreddits)
+        for keyword, request_subreddit, listing in requests.itervalues():
+            if request_subreddit != subreddit:
+                continue
+            for word in keyword.split():
+                pattern = re.sub('(.)', r'\1\\s*\\W?', re.sub('[^0-9A-Za-z%]', '', word))
+                if pattern and re.search(pattern, title, re.IGNORECASE):
+                    matches += 1
+                    break
+    return matches
+
+
+def bench_matcher(keywords, titles, subreddits, seed, compare):
+    """
+    Times compiling the requests and matching titles against them.
+    :param keywords: Number of requests
+    :param titles: Number of titles to match
+    :param subreddits: Number of subreddits the requests are spread over
+    :param seed: Seed for the synthetic requests and titles
+    :param compare: Also time the per-keyword regex scan the index replaced
+    """
+    generator = random.Random(seed)
+    vocabulary = _words(generator, max(keywords, 100))
+    requests = synthetic_requests(generator, keywords, subreddits, vocabulary)
+    sample = synthetic_titles(generator, titles, vocabulary)
+
+    started = time.time()
+    matcher = KeywordMatcher(requests)
+    compiled = time.time() - started
+
+    started = time.time()
+    matches = 0
+    for number, title in enumerate(sample):
+        matches += len(matcher.match(title, u"sub{0}".format(number % subreddits), u"New"))
+    elapsed = time.time() - started
+
+    print("matcher: {0} keywords over {1} subreddits, compiled in {2:.3f}s".format(keywords, subreddits, compiled))
+    print("matcher: {0} titles in {1:.3f}s, {2:.0f} titles/s, {3} matches".format(
+        titles, elapsed, titles / elapsed, matches))
+
+    if compare:
+        # The scan is slow enough with large request sets that a slice of the titles is enough to measure it.
+        sample = sample[:max(1, titles // 100)]
+        started = time.time()
+        matches = _regex_scan(requests, sample, subreddits)
+        elapsed = time.time() - started
+        print("regex scan: {0} titles in {1:.3f}s, {2:.0f} titles/s, {3} matching requests".format(
+            len(sample), elapsed, len(sample) / elapsed, matches))
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+class _RecordingMetrics(Metrics):
+    """
+    Metrics which also keep every timing, for percentiles.
+    """
+    def __init__(self):
+        super(_RecordingMetrics, self).__init__()
+        self.samples = {}
+
+    def observe(self, name, seconds, **labels):
+        super(_RecordingMetrics, self).observe(name, seconds, **labels)
+        with self.lock:
+            self.samples.setdefault(labels.get('stage', name), []).append(seconds)
+
+
+class _ReplayName(object):
+    def __init__(self, display_name):
+        self.display_name = display_name
+
+
+class ReplayPost(object):
+    """
+    Post read from a listing fixture, with the attributes the fetcher reads of a praw submission.
+    """
+    def __init__(self, data):
+        self.id = data['id']
+        self.fullname = data.get('name') or 't3_' + data['id']
+        self.title = data['title']
+        self.url = data.get('url', u'')
+        self.permalink = data.get('permalink', u'')
+        self.score = data.get('score', 0)
+        self.num_comments = data.get('num_comments', 0)
+        self.created_utc = data.get('created_utc', 0.0)
+        self.link_flair_text = data.get('link_flair_text')
+        self.domain = data.get('domain', u'')
+        self.selftext = data.get('selftext', u'')
+        self.subreddit = _ReplayName(data['subreddit'])
+
+
+class _ReplaySubreddit(object):
+    def __init__(self, reddit, name):
+        self.reddit = reddit
+        self.subreddits = list(reddit.posts) if name.lower() == 'all' else name.lower().split('+')
+
+    def get_new(self, limit=None, params=None):
+        # Newest first, like Reddit. Asking for the posts before a fullname returns the ones just newer than it.
+        params = params or {}
+        limit = params.get('limit', limit) or 25
+        posts = sorted((post for name in self.subreddits for post in self.reddit.visible(name)),
+                       key=lambda post: post.created_utc, reverse=True)
+        before = params.get('before')
+        if before:
+            for position, post in enumerate(posts):
+                if post.fullname == before:
+                    return posts[:position][-limit:]
+            # Reddit returns nothing before a post which is no longer on the listing.
+            return []
+        return posts[:limit]
+
+    get_hot = get_rising = get_controversial = get_top = get_new
+
+
+class ReplayReddit(object):
+    """
+    Stand-in for the praw client which serves listing fixtures, revealing a further share of each subreddit's posts
+    every cycle as if they were being submitted.
+    """
+    def __init__(self, posts, cycles):
+        """
+        :param posts: Posts of every subreddit
+        :param cycles: Cycles over which the posts are revealed
+        """
+        self.posts = {}
+        for post in sorted(posts, key=lambda post: post.created_utc):
+            self.posts.setdefault(post.subreddit.display_name.lower(), []).append(post)
+        self.cycles = cycles
+        self.cycle = 0
+
+    def advance(self):
+        self.cycle += 1
+
+    def visible(self, subreddit):
+        posts = self.posts.get(subreddit, [])
+        return posts[:len(posts) * min(self.cycle, self.cycles) // self.cycles]
+
+    def get_subreddit(self, name):
+        return _ReplaySubreddit(self, name)
+
+
+def load_fixtures(paths):
+    """
+    Reads listing fixtures saved from Reddit's JSON listings, such as https://www.reddit.com/r/python/new.json.
+    :param paths: Paths of the fixture files
+    :return: List of posts
+    """
+    posts = {}
+    for path in paths:
+        with open(path) as f:
+            listing = json.load(f)
+        for listing in listing if isinstance(listing, list) else [listing]:
+            for child in listing['data']['children']:
+                if child.get('kind', 't3') == 't3':
+                    posts[child['data']['id']] = ReplayPost(child['data'])
+    return posts.values()
+
+
+def synthetic_posts(generator, subreddits, count, vocabulary):
+    """
+    Builds posts spread evenly over the subreddits, numbered in order of submission.
+    :param count: Posts per subreddit
+    """
+    titles = synthetic_titles(generator, subreddits * count, vocabulary)
+    return [ReplayPost(dict(id=_base36(number + 1), title=title, subreddit=u"sub{0}".format(number % subreddits),
+                            created_utc=float(number)))
+            for number, title in enumerate(titles)]
+
+
+def _base36(number):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    result = ''
+    while number:
+        number, digit = divmod(number, 36)
+        result = digits[digit] + result
+    return result or '0'
+
+
+class SMTPSink(smtpd.SMTPServer):
+    """
+    Local SMTP server which accepts and counts the messages, served on a daemon thread.
+    """
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.received = 0
+        self.thread = threading.Thread(target=asyncore.loop, kwargs=dict(timeout=0.1))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.received += 1
+
+
+def bench_replay(posts, keywords, users, cycles, digest, seed, sink, firehose=False, processes=0):
+    """
+    Replays the posts through fetching, matching, deduplication and notification, one engine cycle per revealed share.
+    :param posts: Posts of the replayed listings
+    :param keywords: Number of requests
+    :param users: Number of users the requests are spread over
+    :param cycles: Number of polling cycles
+    :param digest: Send the matches of a cycle as a single email
+    :param seed: Seed for the synthetic requests
+    :param sink: SMTP sink the emails are sent to
+    :param firehose: Read the New listings from r/all/new
+    :param processes: Number of processes the matching is sharded over
+    """
+    generator = random.Random(seed)
+    subreddits = sorted(set(post.subreddit.display_name for post in posts))
+    vocabulary = sorted(set(word for post in posts for word in re.findall('[0-9A-Za-z]{3,}', post.title.lower())))
+    user_requests = {}
+    for number, (keyword, subreddit, listing) in enumerate(sorted(
+            synthetic_requests(generator, keywords, len(subreddits), vocabulary or _words(generator, 100)).values())):
+        subreddit = subreddits[int(subreddit[3:])]
+        user_requests.setdefault(u"user{0}@example.com".format(number % users), {})[
+            keyword + subreddit + listing] = keyword, subreddit, listing
+
+    directory = tempfile.mkdtemp()
+    store = Store(directory + '/bench.db')
+    metrics = _RecordingMetrics()
+    reddit = ReplayReddit(posts, cycles)
+    engine = Engine(concurrency=1, store=store, metrics=metrics, firehose=firehose, processes=processes)
+    engine.pool = FetchPool(metrics=metrics, client=lambda: reddit)
+    engine.sender = SendQueue(Notifier(SMTPSession('127.0.0.1', sink.port, user=None, starttls=False), digest=digest,
+                                       delivered=store.add_notifications),
+                              dead_letters=directory + '/undelivered.log', metrics=metrics)
+    engine.set_users(user_requests)
+    received = sink.received
+
+    memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.time()
+    for cycle in range(cycles):
+        reddit.advance()
+        engine.poll(list(engine.plan))
+    elapsed = time.time() - started
+    engine.close(drain=True)
+    drained = time.time() - started
+    growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - memory
+    store.close()
+    shutil.rmtree(directory)
+
+    scanned = sum(count for (name, _), count in metrics.counters.items() if name == 'posts_scanned_total')
+    matches = sum(count for (name, _), count in metrics.counters.items() if name == 'matches_total')
+    calls = sum(count for (name, _), count in metrics.counters.items() if name == 'api_calls_total')
+    dead = sum(count for (name, _), count in metrics.counters.items() if name == 'notifications_dead_lettered_total')
+    print("replay: {0} requests, {1} users, {2} subreddits, {3} posts, {4} cycles, {5} processes{6}, {7} requests to "
+          "Reddit".format(keywords, users, len(subreddits), len(posts), cycles, processes,
+                          ", firehose" if firehose else "", calls))
+    print("  {0} posts scanned in {1:.3f}s, {2:.0f} posts/s, {3} matches, {4} emails received after {5:.3f}s, {6} "
+          "dead lettered".format(scanned, elapsed, scanned / elapsed if elapsed else 0, matches,
+                                 sink.received - received, drained, dead))
+    for stage in ('fetch', 'match', 'send', 'save', 'cycle_seconds'):
+        samples = metrics.samples.get(stage, [])
+        print("  {0:<6} p50 {1:8.2f}ms  p95 {2:8.2f}ms  p99 {3:8.2f}ms  ({4} samples)".format(
+            stage.split('_')[0], _percentile(samples, 0.5) * 1000, _percentile(samples, 0.95) * 1000,
+            _percentile(samples, 0.99) * 1000, len(samples)))
+    print("  peak memory grew {0} KB, {1} seen posts kept".format(
+        growth, sum(len(seen) for seen in engine.seen.values())))
+
+
+def _counts(value):
+    return [int(count) for count in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the keyword matcher on synthetic requests and titles, or "
+                                                 "replay listings through the whole polling pipeline offline. Counts "
+                                                 "may be comma separated lists, running every combination.")
+    parser.add_argument("--keywords", type=_counts, default=[10000], help="number of requests")
+    parser.add_argument("--titles", type=int, default=5000, help="number of titles to match")
+    parser.add_argument("--subreddits", type=_counts, default=[10], help="subreddits the requests are spread over")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic data")
+    parser.add_argument("--compare", action="store_true", help="also time the per-keyword regex scan")
+    parser.add_argument("--replay", action="store_true", help="replay listings through fetching, matching, "
+                                                              "deduplication and a local SMTP sink")
+    parser.add_argument("--fixtures", nargs="+", help="Reddit listing JSON files to replay instead of synthetic "
+                                                      "posts")
+    parser.add_argument("--posts", type=_counts, default=[1000], help="synthetic posts per subreddit")
+    parser.add_argument("--cycles", type=_counts, default=[10], help="polling cycles the posts are revealed over")
+    parser.add_argument("--users", type=_counts, default=[1], help="users the requests are spread over")
+    parser.add_argument("--digest", action="store_true", help="send the matches of a cycle as a single email")
+    parser.add_argument("--firehose", action="store_true", help="read the New listings from r/all/new")
+    parser.add_argument("--processes", type=_counts, default=[0], help="processes the matching is sharded over")
+    args = parser.parse_args()
+
+    if not args.replay:
+        for keywords, subreddits in itertools.product(args.keywords, args.subreddits):
+            bench_matcher(keywords, args.titles, subreddits, args.seed, args.compare)
+        return
+
+    sink = SMTPSink()
+    if args.fixtures:
+        posts = load_fixtures(args.fixtures)
+        for keywords, users, cycles, processes in itertools.product(args.keywords, args.users, args.cycles,
+                                                                    args.processes):
+            bench_replay(posts, keywords, users, cycles, args.digest, args.seed, sink, args.firehose, processes)
+        return
+
+    for subreddits, count in itertools.product(args.subreddits, args.posts):
+        generator = random.Random(args.seed)
+        posts = synthetic_posts(generator, subreddits, count, _words(generator, 1000))
+        for keywords, users, cycles, processes in itertools.product(args.keywords, args.users, args.cycles,
+                                                                    args.processes):
+            bench_replay(posts, keywords, users, cycles, args.digest, args.seed, sink, args.firehose, processes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,436 @@
+import requests
+import praw
+import threading
+import time
+
+from events import EventStream, event
+from fetch import FIREHOSE, FetchPool, group_requests, groups_of, plan_fetches
+from matcher import KeywordMatcher
+from metrics import Metrics
+from notify import Match, Notifier, SendQueue
+from scheduler import Scheduler
+from seen import SeenPosts
+from shards import ShardedMatcher
+from store import shared
+
+# Posts of the firehose remembered to skip those read twice, such as after its cursor is resynchronised.
+STREAM_SIZE = 10000
+
+
+def run_once(function):
+    """
+    Allows the connect log message to be run only once on start up.
+    :param function: The connect method
+    :return: the wrapper to allowing it to be called again.
+    """
+    def wrapper(*args, **kwargs):
+        if not wrapper.has_run:
+            wrapper.has_run = True
+            return function(*args, **kwargs)
+
+    wrapper.has_run = False
+    return wrapper
+
+
+class Listener(object):
+    """
+    Receives the progress of the engine. Every method does nothing by default so listeners only override what they use.
+    The methods are called on the thread running the engine.
+    """
+    def missing_email(self):
+        pass
+
+    def connection(self):
+        pass
+
+    def reconnect(self):
+        pass
+
+    def request_found(self, title):
+        pass
+
+    def no_connection(self):
+        pass
+
+    def subreddit_noexists(self, subreddit):
+        pass
+
+    def timeout(self):
+        pass
+
+    def http(self):
+        pass
+
+    def status(self, condition, color):
+        pass
+
+    def inside_loop(self):
+        pass
+
+    def query_requests(self, keyword):
+        pass
+
+    def fetch_latency(self, listing, seconds):
+        pass
+
+
+class Engine(object):
+    """
+    Polls Reddit for the requests of every user, matches the posts and sends the email notifications. The requests of
+    all users are indexed together so each listing is fetched once however many users watch it. It has no user
+    interface and reports its progress to a listener.
+    """
+    def __init__(self, listener=None, concurrency=1, digest=False, store=None, events=None, metrics=None,
+                 firehose=False, processes=0):
+        """
+        :param listener: Listener told about the engine's progress
+        :param concurrency: Number of listings downloaded at the same time
+        :param digest: Send the matches of a cycle as a single email
+        :param store: Store the seen posts, cursors and delivered notifications are kept in
+        :param events: Stream the fetches, matches and errors are published to
+        :param metrics: Metrics each stage of polling is counted and timed in
+        :param firehose: Read the New listings of every watched subreddit from the site-wide New listing, at a fixed
+        cost however many subreddits are watched
+        :param processes: Number of processes the matching is sharded over, or 0 to match on the engine's thread
+        """
+        # The shard processes are started before the engine starts its own threads. They only run the matcher, so a
+        # store connection or thread the caller opened earlier, which they inherit when forked, is never used in them.
+        self.sharded = ShardedMatcher(processes) if processes else None
+        self.listener = listener or Listener()
+        self.initialize = True
+        self.reconnect = False
+        self.users = {}
+        self.requests = {}
+        # Guards the pause and stop flags and the request state swapped in by set_values. Waiting on it wakes the
+        # engine as soon as any of them change.
+        self.control = threading.Condition()
+        self.paused = False
+        self.stopped = False
+        self.seen = {}
+        self.matcher = KeywordMatcher()
+        self.groups = {}
+        self.plan = {}
+        # Listings found not to exist, with the requests watching them at the time, and the subreddits which are queried
+        # on their own to find out which of a combined query does not exist.
+        self.quarantined = {}
+        self.isolated = set()
+        self.firehose = firehose
+        self.stream = SeenPosts(max_size=STREAM_SIZE)
+        self.scheduler = Scheduler()
+        self.store = store or shared()
+        self.metrics = metrics or Metrics()
+        self.pool = FetchPool(concurrency, metrics=self.metrics)
+        self.pool.cursors.update(self.store.load_cursors())
+        self.sender = SendQueue(Notifier(digest=digest, delivered=self.store.add_notifications), metrics=self.metrics)
+        self.events = events or EventStream()
+
+    def run(self):
+        if self.users:
+            self.get_requests()
+        else:
+            self.listener.missing_email()
+            self.listener.status("Down", "red")
+
+    def get_requests(self):
+        """
+        Retrieve the requests from Reddit.
+        """
+
+        while True:
+
+            # Sleep until resumed, or until the next listing is due. Both waits end early when the requests change or
+            # the engine is paused or stopped.
+            with self.control:
+                while self.paused and not self.stopped:
+                    self.control.wait()
+                if self.stopped:
+                    return
+
+                wait = self.scheduler.wait_time()
+                if wait is None or wait > 0:
+                    with self.metrics.timer('stage_seconds', stage='sleep'):
+                        self.control.wait(wait)
+                    continue
+
+            self.poll(self.scheduler.due())
+
+    def poll(self, keys):
+        """
+        Runs one polling cycle: fetches the listings, matches their posts and queues the notifications.
+        :param keys: (subreddit, listing) keys of the listings to fetch
+        """
+        with self.control:
+            users, user_requests, groups, matcher, plan = self.users, self.requests, self.groups, self.matcher, \
+                self.plan
+
+        for email in set(self.seen) - set(users):
+            self.seen.pop(email).save()
+        due = [plan[key] for key in keys if key in plan]
+        cycle_started = time.time()
+        self.metrics.set('listings_due', len(due))
+        self.metrics.set('requests', len(user_requests))
+        self.metrics.set('users', len(users))
+
+        connecting = run_once(self.connect)
+
+        # Emails are sent on their own thread so a slow mail server never holds up polling.
+        self.sender.start()
+        self.events.start()
+
+        # Each listing is fetched once, New listings sharing a multireddit query with other subreddits, and its posts
+        # are matched against every request watching it. A listing which fails is retried on its own backoff while the
+        # others carry on.
+        fetched = failed = 0
+        for query, posts, latency, error in self.pool.fetch_all(list(due)):
+            key = query.subreddit, query.listing
+            due.remove(query)
+            fetched += 1
+            if error:
+                failed += 1
+                self._failed(query, error)
+                if isinstance(error, requests.ConnectionError):
+                    connecting.has_run = False
+            else:
+                self.scheduler.record(key, [post.id for post in posts])
+
+                if query.subreddit == FIREHOSE and query.subreddits != (FIREHOSE,):
+                    self.listener.query_requests(u"r/{0}/{1} for {2} subreddits".format(
+                        FIREHOSE, query.listing, len(query.subreddits)))
+                else:
+                    self.listener.query_requests(u", ".join(user_requests[request][0] for name in query.subreddits
+                                                               for request in groups[(name, query.listing)]))
+                self.listener.fetch_latency(u"r/{0}/{1}".format(query.subreddit, query.listing), latency)
+                self.events.publish(event('fetch', subreddit=query.subreddit, listing=query.listing,
+                                          latency=latency, posts=len(posts)))
+                self.metrics.observe('stage_seconds', latency, stage='fetch')
+                self.metrics.increment('posts_scanned_total', len(posts))
+
+                match_started = time.time()
+                # Each post is matched under the subreddit of every group of requests it belongs to.
+                if query.subreddit == FIREHOSE and query.listing == 'new':
+                    posts = self._unread(posts)
+                posts = [(post, group) for post in posts for group in groups_of(query, post.subreddit)]
+                matches = matcher.match_all([(post.title, subreddit, query.listing, post) for post, subreddit in posts])
+                for (post, subreddit), post_matches in zip(posts, matches):
+                    # Connecting/Reconnecting log message
+                    #connecting(self.initialize, self.reconnect)
+
+                    self.listener.inside_loop()
+
+                    # Check if the post has been checked already for the user whose request it matched. If not, send
+                    # email notification and add it to the user's checked list.
+                    for match in post_matches:
+                        # Shards recompiled part way through the cycle can return requests which were added after it
+                        # began. Those are left to the next cycle.
+                        if match not in user_requests:
+                            continue
+                        email = match[0]
+                        seen = self._seen_posts(email)
+                        if post.id not in seen:
+                            matched_keyword, matched_subreddit, matched_listing = user_requests[match]
+                            self.sender.put(email, Match(post.title, matched_keyword, matched_subreddit,
+                                                         matched_listing, post.url, post.permalink, post.id))
+                            seen.add(post.id)
+                            self.metrics.increment('matches_total')
+                            self.listener.request_found(post.title)
+                            self.events.publish(event('match', email=email, subreddit=post.subreddit,
+                                                      listing=matched_listing, keyword=matched_keyword,
+                                                      post_id=post.id, title=post.title, link=post.url,
+                                                      permalink=post.permalink, score=post.score,
+                                                      created=post.created_utc, latency=latency))
+                self.metrics.observe('stage_seconds', time.time() - match_started, stage='match')
+
+            # Pausing or stopping takes effect between listings. The listings not reached yet are polled first after
+            # resuming.
+            if self.paused or self.stopped:
+                self.scheduler.expedite((query.subreddit, query.listing) for query in due)
+                break
+
+        # Send the digest of this round's matches when digest mode is on.
+        self.sender.flush()
+
+        if fetched and failed == fetched:
+            self.listener.status("Down", "red")
+        elif fetched and not self.paused:
+            self.listener.status("Up", "green")
+
+        # Keep the checked posts and cursors across restarts so posts still on the listings are not notified again.
+        with self.metrics.timer('stage_seconds', stage='save'):
+            self._save()
+        self.metrics.set('seen_posts', sum(len(seen) for seen in self.seen.values()))
+        self.metrics.set('send_queue_size', self.sender.queue.qsize())
+        self.metrics.observe('cycle_seconds', time.time() - cycle_started)
+
+        self.initialize = False
+
+    def pause(self):
+        """
+        Pauses polling after the listing being downloaded, keeping every cache.
+        """
+        with self.control:
+            self.paused = True
+            self.control.notify_all()
+
+    def resume(self):
+        """
+        Resumes polling, starting with the listings that are overdue.
+        """
+        with self.control:
+            self.paused = False
+            self.control.notify_all()
+
+    def stop(self):
+        """
+        Stops polling after the listing being downloaded, returning from run.
+        """
+        with self.control:
+            self.stopped = True
+            self.control.notify_all()
+
+    def close(self, drain=True, timeout=30):
+        """
+        Shuts down the email sender and the event sinks once polling has stopped.
+        :param drain: Deliver the queued emails before stopping the sender
+        :param timeout: Seconds to wait for the sender and each sink to finish
+        """
+        self.sender.stop(drain=drain, timeout=timeout)
+        self.events.stop(timeout)
+        self._save()
+        if self.sharded:
+            self.sharded.close()
+
+    def set_values(self, new_email, new_requests):
+        """
+        Updates the engine with a single user's email and requests.
+        :param new_email: User's email
+        :param new_requests: User's requests
+        :return:
+        """
+        self.set_users({new_email: new_requests} if new_email else {})
+
+    def set_users(self, users):
+        """
+        Updates the engine with the requests of every user. A running engine picks them up without restarting, and
+        keeps its seen posts, cursors and schedule for the listings still requested.
+        :param users: Dictionary of each user's email to their requests
+        """
+        users = dict(users)
+        new_requests = {}
+        for email, requests in users.iteritems():
+            for key, request in requests.iteritems():
+                new_requests[(email, key)] = request
+
+        groups = group_requests(new_requests)
+        matcher = self.sharded or KeywordMatcher(new_requests)
+
+        with self.control:
+            # The shards are recompiled in place, so they change along with the requests a new cycle snapshots.
+            if self.sharded:
+                self.sharded.compile(new_requests)
+            # A quarantined listing is tried again once the requests watching it are edited.
+            self.quarantined = dict((group, watching) for group, watching in self.quarantined.iteritems()
+                                    if self._watching(groups, new_requests, group) == watching)
+            self.isolated = set()
+            self.users = users
+            self.requests = new_requests
+            self.matcher = matcher
+            self.groups = groups
+            self._replan()
+            self.control.notify_all()
+
+    def _replan(self):
+        groups = dict((group, keys) for group, keys in self.groups.iteritems() if group not in self.quarantined)
+        queries = plan_fetches(groups, isolated=self.isolated, firehose=self.firehose)
+        self.plan = dict(((query.subreddit, query.listing), query) for query in queries)
+        self.scheduler.update(self.plan)
+        # The cursors of listings no longer queried are dropped, and with them their rows at the next save.
+        for key in [key for key in self.pool.cursors if key not in self.plan]:
+            del self.pool.cursors[key]
+
+    def _unread(self, posts):
+        """
+        Keeps the posts of the site-wide New listing which were not read before.
+        :param posts: Posts of the site-wide New listing
+        """
+        unread = []
+        for post in posts:
+            if post.id not in self.stream:
+                self.stream.add(post.id)
+                unread.append(post)
+        return unread
+
+    @staticmethod
+    def _watching(groups, requests, group):
+        return frozenset((key, requests[key]) for key in groups.get(group, ()))
+
+    def _failed(self, query, error):
+        """
+        Handles a listing which could not be fetched, leaving the other listings to carry on.
+        :param query: The failed query
+        :param error: Its error
+        """
+        key = query.subreddit, query.listing
+
+        # No such subreddit error
+        if isinstance(error, praw.errors.InvalidSubreddit):
+            self.events.publish(event('error', error="invalid subreddit", subreddit=query.subreddit,
+                                      listing=query.listing))
+            self.metrics.increment('errors_total', type="invalid_subreddit")
+            with self.control:
+                if len(query.subreddits) > 1 and query.subreddit != FIREHOSE:
+                    # Reddit does not say which subreddit of a combined query is missing, so each is queried alone.
+                    self.isolated.update((name, query.listing) for name in query.subreddits)
+                else:
+                    self.quarantined[key] = self._watching(self.groups, self.requests, key)
+                self._replan()
+            if len(query.subreddits) == 1:
+                self.listener.subreddit_noexists(query.subreddit)
+            return
+
+        # No internet error
+        if isinstance(error, requests.ConnectionError):
+            self.listener.no_connection()
+            self.reconnect = True
+            kind = "connection"
+
+        # Fail to get requests and time out
+        elif isinstance(error, requests.exceptions.ReadTimeout):
+            self.listener.timeout()
+            kind = "timeout"
+
+        elif isinstance(error, praw.errors.HTTPException):
+            self.listener.http()
+            kind = "http"
+
+        # Anything else, such as a redirect, a body which is not JSON or a broken chunked response, is backed off the
+        # same way and counted under its type, since one listing must never stop the engine.
+        else:
+            kind = type(error).__name__
+
+        self.scheduler.fail(key)
+        self.events.publish(event('error', error=kind, subreddit=query.subreddit, listing=query.listing))
+        self.metrics.increment('errors_total', type=kind)
+
+    def _seen_posts(self, email):
+        seen = self.seen.get(email)
+        if seen is None:
+            seen = self.seen[email] = SeenPosts(store=self.store, user=email).load()
+        return seen
+
+    def _save(self):
+        for seen in self.seen.values():
+            seen.save()
+        self.store.save_cursors(self.pool.cursors)
+
+    def connect(self, initialize, reconnect):
+        """
+        Checks whether the program has recently started or is resuming from a disconnect.
+        :param initialize: Recently started?
+        :param reconnect: Recently disconnected?
+        """
+        if initialize:
+            self.listener.connection()
+        elif reconnect:
+            self.listener.reconnect()
+            self.reconnect = False
+
@@ -0,0 +1,209 @@
+import json
+import Queue
+import socket
+import threading
+import time
+
+import requests
+
+from collections import namedtuple
+
+# Events a sink holds before new ones are dropped, and events written at a time.
+QUEUE_SIZE = 10000
+BATCH = 500
+# Seconds a webhook request may take.
+WEBHOOK_TIMEOUT = 10
+
+# Something that happened while polling: a 'fetch' of a listing, a 'match' of a post for a user, or an 'error'. Fields
+# which do not apply to the kind of event are None.
+Event = namedtuple('Event', 'kind time email subreddit listing keyword post_id title link permalink score created '
+                            'latency posts error')
+Event.__new__.__defaults__ = (None,) * len(Event._fields)
+
+
+def event(kind, **fields):
+    """
+    :param kind: 'fetch', 'match' or 'error'
+    :param fields: Fields of the event which apply to its kind
+    :return: The event, stamped with the current time
+    """
+    return Event(kind, time.time(), **fields)
+
+
+def to_json(item):
+    return json.dumps(dict((name, value) for name, value in item._asdict().iteritems() if value is not None))
+
+
+class Sink(object):
+    """
+    Destination of the event stream. Events are queued without waiting and written in batches on the sink's own
+    thread, so a slow sink only falls behind, dropping events once its queue is full, and never holds up polling.
+    """
+    def __init__(self, size=QUEUE_SIZE, batch=BATCH):
+        """
+        :param size: Events held before new ones are dropped
+        :param batch: Most events written at a time
+        """
+        self.queue = Queue.Queue(size)
+        self.batch = batch
+        self.dropped = 0
+        self.failed = 0
+        self.thread = None
+
+    def put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except Queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Writes the queued events and stops the sink's thread.
+        :param timeout: Seconds to wait for the thread to finish
+        """
+        if not self.thread or not self.thread.is_alive():
+            return
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def write(self, items):
+        """
+        Writes a batch of events. Called on the sink's thread only.
+        :param items: List of events, oldest first
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            items = [self.queue.get()]
+            while len(items) < self.batch:
+                try:
+                    items.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+            if None in items:
+                stopping = True
+                items = [item for item in items if item is not None]
+            if not items:
+                continue
+
+            try:
+                self.write(items)
+            except Exception:
+                # The batch is lost, but the sink keeps going and the next batch is tried as usual, whatever went wrong
+                # with it, such as an event which cannot be encoded.
+                self.failed += len(items)
+        self.close()
+
+
+class JSONLinesSink(Sink):
+    """
+    Appends each event to a file as a line of JSON.
+    """
+    def __init__(self, path, **kwargs):
+        super(JSONLinesSink, self).__init__(**kwargs)
+        self.path = path
+        self.file = None
+
+    def write(self, items):
+        if self.file is None:
+            self.file = open(self.path, 'a')
+        self.file.write(''.join(to_json(item) + '\n' for item in items))
+        self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+class UnixSocketSink(Sink):
+    """
+    Streams the events as lines of JSON to a listening Unix socket, reconnecting after the listener goes away.
+    """
+    def __init__(self, path, **kwargs):
+        super(UnixSocketSink, self).__init__(**kwargs)
+        self.path = path
+        self.socket = None
+
+    def write(self, items):
+        if self.socket is None:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.connect(self.path)
+            self.socket = connection
+        try:
+            self.socket.sendall(''.join(to_json(item) + '\n' for item in items))
+        except socket.error:
+            self.close()
+            raise
+
+    def close(self):
+        if self.socket:
+            self.socket.close()
+            self.socket = None
+
+
+class WebhookSink(Sink):
+    """
+    Posts each batch of events to a URL as newline delimited JSON.
+    """
+    def __init__(self, url, timeout=WEBHOOK_TIMEOUT, **kwargs):
+        super(WebhookSink, self).__init__(**kwargs)
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def write(self, items):
+        response = self.session.post(self.url, data=''.join(to_json(item) + '\n' for item in items),
+                                     headers={'Content-Type': 'application/x-ndjson'}, timeout=self.timeout)
+        response.raise_for_status()
+
+    def close(self):
+        self.session.close()
+
+
+class CallbackSink(Sink):
+    """
+    Hands each event to a function, such as one emitting a Qt signal for the log viewer.
+    """
+    def __init__(self, callback, **kwargs):
+        super(CallbackSink, self).__init__(**kwargs)
+        self.callback = callback
+
+    def write(self, items):
+        for item in items:
+            self.callback(item)
+
+
+class EventStream(object):
+    """
+    Publishes the engine's events to every sink.
+    """
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks or [])
+
+    def add(self, sink):
+        self.sinks.append(sink)
+
+    def publish(self, item):
+        for sink in self.sinks:
+            sink.put(item)
+
+    def start(self):
+        for sink in self.sinks:
+            sink.start()
+
+    def stop(self, timeout=None):
+        for sink in self.sinks:
+            sink.stop(timeout)
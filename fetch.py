@@ -0,0 +1,328 @@
+import praw
+import Queue
+import threading
+import time
+
+from collections import namedtuple
+
+from matcher import group_key
+from metrics import Metrics
+from transport import DEFAULT_RATE, RateLimiter, ResponseCache, Transport
+
+USER_AGENT = "desktop:posttid:v1.0"
+
+# Reddit returns at most 100 posts per page and 25 when no limit is given.
+PAGE_LIMIT = 100
+DEFAULT_LIMIT = 25
+# Subreddits merged into one multireddit query such as r/a+b+c/new, and the longest such name, so that a combined query
+# stays a single page and well under url length limits.
+MAX_SUBREDDITS_PER_QUERY = 10
+MAX_QUERY_LENGTH = 500
+
+# Pages requested newer than the New listing's cursor before the rest of a gap is skipped, and empty responses in a row
+# before the whole listing is fetched again in case the cursor's post was removed since the first of them was checked.
+MAX_GAP_PAGES = 5
+RESYNC_AFTER = 10
+
+# Subreddit whose New listing is the stream of every new submission on the site.
+FIREHOSE = 'all'
+# Subreddits standing for the posts of many others, which are never merged with other subreddits since their posts
+# cannot be told apart by the subreddit they were submitted to.
+AGGREGATES = ('all', 'popular')
+
+# A single listing request: the subreddit name as sent to Reddit, the listing, the subreddits it covers and the number
+# of posts to ask for.
+Query = namedtuple('Query', 'subreddit listing subreddits limit')
+
+
+class Post(namedtuple('Post', 'id fullname title url permalink subreddit score num_comments created_utc '
+                             'link_flair_text domain selftext')):
+    """
+    Compact, read-only record of a submission holding only the fields the engine uses, with the subreddit by name.
+    Listings are converted to these as soon as they are downloaded, so that praw's submissions, which keep their raw
+    JSON and a reference to the client, are freed before matching.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_submission(cls, submission):
+        """
+        :param submission: Praw submission
+        :return: Record of the submission
+        """
+        return cls(submission.id, submission.fullname, submission.title, submission.url, submission.permalink,
+                   submission.subreddit.display_name, submission.score, submission.num_comments,
+                   submission.created_utc, submission.link_flair_text, submission.domain, submission.selftext)
+
+
+def group_requests(requests):
+    """
+    Groups the requests which watch the same listing of a subreddit so that each listing is only fetched once.
+    :param requests: User's requests
+    :return: Dictionary of (subreddit, listing) to the keys of the requests watching it
+    """
+    groups = {}
+    for key, (keyword, subreddit, listing) in requests.iteritems():
+        groups.setdefault(group_key(subreddit, listing), []).append(key)
+    return groups
+
+
+def plan_fetches(groups, max_subreddits=MAX_SUBREDDITS_PER_QUERY, max_length=MAX_QUERY_LENGTH, isolated=(),
+                 firehose=False):
+    """
+    Merges the subreddits which share the New listing into combined multireddit queries. The New cursor pages through
+    everything posted since the last poll, so a combined New listing misses nothing. Reddit ranks the other listings
+    across all the subreddits of a multireddit, where a busy subreddit could push the posts of a quiet one out of the
+    page, so each subreddit is queried on its own for those, as are r/all, r/popular and multireddits requested by name.
+    :param groups: Grouped requests from group_requests
+    :param max_subreddits: Most subreddits in one query
+    :param max_length: Longest combined subreddit name in one query
+    :param isolated: Keys of the groups which are queried on their own
+    :param firehose: Read the New listing of every subreddit and of r/all from the site-wide New listing in a single
+    query, whose posts are filtered by subreddit afterwards
+    :return: List of queries
+    """
+    listings = {}
+    for subreddit, listing in sorted(groups):
+        listings.setdefault(listing, []).append(subreddit)
+
+    plan = []
+    if firehose and 'new' in listings:
+        # r/popular and multireddits requested by name are still queried on their own, since the site-wide listing
+        # holds more than r/popular and misses the subreddits of a multireddit which opt out of r/all.
+        folded = [subreddit for subreddit in listings['new'] if subreddit == FIREHOSE or combinable(subreddit)]
+        listings['new'] = [subreddit for subreddit in listings['new'] if subreddit not in folded]
+        if folded:
+            plan.append(Query(FIREHOSE, 'new', tuple(folded), PAGE_LIMIT))
+
+    for listing, subreddits in sorted(listings.iteritems()):
+        chunk = []
+        for subreddit in subreddits:
+            if listing != 'new' or (subreddit, listing) in isolated or not combinable(subreddit):
+                plan.append(_query([subreddit], listing))
+                continue
+            if chunk and (len(chunk) == max_subreddits or len('+'.join(chunk + [subreddit])) > max_length):
+                plan.append(_query(chunk, listing))
+                chunk = []
+            chunk.append(subreddit)
+        if chunk:
+            plan.append(_query(chunk, listing))
+
+    # A combined query can come out the same as a multireddit requested by name, such as r/a+b, which then share it.
+    queries = {}
+    for query in plan:
+        key = query.subreddit, query.listing
+        if key in queries:
+            other = queries[key]
+            query = query._replace(subreddits=other.subreddits + query.subreddits, limit=max(other.limit, query.limit))
+        queries[key] = query
+    return sorted(queries.values())
+
+
+def groups_of(query, subreddit):
+    """
+    Finds the groups of requests a post retrieved by a query belongs to. A query made for a single group, such as
+    r/all or a multireddit requested by name, returns only that group's posts. The posts of a combined query belong to
+    the groups of the subreddit they were submitted to.
+    :param query: Query the post was retrieved for
+    :param subreddit: Subreddit the post was submitted to
+    :return: Subreddits of the groups
+    """
+    if query.subreddits == (query.subreddit,):
+        return query.subreddits
+    subreddit = subreddit.lower()
+    return [name for name in query.subreddits if name == subreddit or name == FIREHOSE or subreddit in name.split('+')]
+
+
+def combinable(subreddit):
+    """
+    :param subreddit: Lowercased subreddit of a request
+    :return: Whether the subreddit can share a multireddit query, its posts being told apart by their subreddit
+    """
+    return subreddit not in AGGREGATES and '+' not in subreddit
+
+
+def _query(subreddits, listing):
+    limit = min(DEFAULT_LIMIT * len(subreddits), PAGE_LIMIT)
+    return Query('+'.join(subreddits), listing, tuple(subreddits), limit)
+
+
+def advance_cursor(cursors, query, posts):
+    """
+    Moves the cursor of a New listing past the posts retrieved from it. This is left to whoever consumes the posts, so
+    that the posts of a listing which are dropped, such as when polling is paused part way through a cycle, are
+    retrieved again next time.
+    :param cursors: Newest post seen on each New listing
+    :param query: Query the posts were retrieved for
+    :param posts: Posts retrieved, newest first
+    """
+    if query.listing.lower() != 'new':
+        return
+    key = query.subreddit, query.listing
+    cursor, empty = cursors.get(key, (None, 0))
+    if posts:
+        cursors[key] = posts[0].fullname, 0
+    else:
+        cursors[key] = cursor, empty + 1
+
+
+class Fetcher(object):
+    """
+    Long-lived Reddit client which retrieves the posts of subreddit listings.
+    """
+    def __init__(self, reddit=None, handler=None, cursors=None, metrics=None):
+        """
+        :param reddit: Reddit client to use instead of a new one
+        :param handler: Praw handler for a new client
+        :param cursors: Newest post seen on each New listing, shared between fetchers and moved by advance_cursor
+        :param metrics: Metrics the requests to Reddit are counted in
+        """
+        self.reddit = reddit or praw.Reddit(user_agent=USER_AGENT, handler=handler)
+        self.cursors = {} if cursors is None else cursors
+        self.metrics = metrics or Metrics()
+
+    def fetch(self, query):
+        """
+        Retrieves the posts currently on a listing. Posts of a combined query are told apart by their subreddit.
+        :param query: Query from plan_fetches
+        :return: List of Post records
+        """
+        subreddit_addr = self.reddit.get_subreddit(query.subreddit)
+        request_method = getattr(subreddit_addr, 'get_{}'.format(query.listing.lower()))
+        if query.listing.lower() == 'new':
+            return self._fetch_new(query, request_method)
+        return self._page(request_method, limit=query.limit)
+
+    def _fetch_new(self, query, request_method):
+        """
+        Retrieves only the posts newer than the newest one seen on the listing so far. The cursor is left where it was.
+        :param query: Query for a New listing
+        :param request_method: Listing getter of the subreddit
+        :return: List of Post records, newest first
+        """
+        key = query.subreddit, query.listing
+        cursor, empty = self.cursors.get(key, (None, 0))
+
+        if not cursor or empty >= RESYNC_AFTER:
+            posts = self._page(request_method, limit=query.limit)
+        else:
+            posts = []
+            before = cursor
+            for page in range(MAX_GAP_PAGES):
+                # Passing the limit as a parameter keeps praw to a single request per page.
+                newer = self._page(request_method, params={'before': before, 'limit': PAGE_LIMIT})
+                if not newer and not page and not empty:
+                    # Reddit also answers with nothing once the cursor's post is removed, so the first empty response
+                    # in a row is checked against the head of the listing, which is kept whole if the cursor is gone.
+                    head = self._page(request_method, params={'limit': PAGE_LIMIT})
+                    fullnames = [post.fullname for post in head]
+                    return head[:fullnames.index(cursor)] if cursor in fullnames else head
+                posts = newer + posts
+
+                # A full page means more posts arrived since the cursor than fit on one page.
+                if len(newer) < PAGE_LIMIT:
+                    break
+                before = newer[0].fullname
+        return posts
+
+    def _page(self, request_method, **kwargs):
+        # Every query asks for at most a page, which praw downloads in a single request.
+        self.metrics.increment('api_calls_total')
+        return [Post.from_submission(submission) for submission in request_method(**kwargs)]
+
+
+class FetchPool(object):
+    """
+    Downloads listings on a bounded number of threads, each owning a Reddit client since praw clients are not thread
+    safe. With a concurrency of one the listings are downloaded in turn on the calling thread.
+    """
+    def __init__(self, concurrency=1, rate=DEFAULT_RATE, metrics=None, client=None):
+        """
+        :param concurrency: Number of listings downloaded at the same time
+        :param rate: Requests per second allowed across all threads
+        :param metrics: Metrics the requests to Reddit are counted in
+        :param client: Function returning the Reddit client of each fetcher, in place of a new praw client
+        """
+        self.metrics = metrics or Metrics()
+        self.client = client
+        self.concurrency = max(1, concurrency)
+        self.limiter = RateLimiter(rate, burst=self.concurrency)
+        self.cache = ResponseCache()
+        self.fetcher = None
+        self.cursors = {}
+        self.tasks = Queue.Queue()
+        self.results = Queue.Queue()
+        self.threads = []
+        self.batch = 0
+
+    def fetch_all(self, queries):
+        """
+        Downloads every query, yielding each as soon as it is done. A failed download is yielded with its error so that
+        the other queries carry on.
+        :param queries: Queries from plan_fetches
+        :return: Generator of (query, posts, seconds taken to download, error or None)
+        """
+        if self.concurrency == 1:
+            if not self.fetcher:
+                self.fetcher = Fetcher(self._client(), self._transport(), cursors=self.cursors, metrics=self.metrics)
+            for query in queries:
+                started = time.time()
+                try:
+                    posts, error = self.fetcher.fetch(query), None
+                except Exception as error:
+                    posts = []
+                else:
+                    advance_cursor(self.cursors, query, posts)
+                yield query, posts, time.time() - started, error
+            return
+
+        self._start_threads()
+
+        # Results left over from a batch which was abandoned part way through are recognised by their batch number.
+        self.batch += 1
+        for query in queries:
+            self.tasks.put((self.batch, query))
+
+        remaining = len(queries)
+        try:
+            while remaining:
+                batch, query, posts, latency = self.results.get()
+                if batch != self.batch:
+                    continue
+                remaining -= 1
+                if isinstance(posts, Exception):
+                    yield query, [], latency, posts
+                else:
+                    advance_cursor(self.cursors, query, posts)
+                    yield query, posts, latency, None
+        finally:
+            # Listings not started when the batch is abandoned are dropped rather than downloaded for nothing.
+            while True:
+                try:
+                    self.tasks.get_nowait()
+                except Queue.Empty:
+                    break
+
+    def _start_threads(self):
+        while len(self.threads) < self.concurrency:
+            thread = threading.Thread(target=self._run)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _client(self):
+        return self.client() if self.client else None
+
+    def _transport(self):
+        return Transport(self.limiter, self.cache, self.concurrency, self.metrics)
+
+    def _run(self):
+        fetcher = Fetcher(self._client(), self._transport(), cursors=self.cursors, metrics=self.metrics)
+        while True:
+            batch, query = self.tasks.get()
+            started = time.time()
+            try:
+                posts = fetcher.fetch(query)
+            except Exception as error:
+                posts = error
+            self.results.put((batch, query, posts, time.time() - started))
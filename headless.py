@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import logging
+import signal
+import threading
+import time
+
+import store
+from engine import Engine, Listener
+from events import EventStream, JSONLinesSink, UnixSocketSink, WebhookSink
+from metrics import Metrics, MetricsServer
+
+
+class LogListener(Listener):
+    """
+    Writes the engine's progress to the log in place of the log viewer.
+    """
+    def __init__(self):
+        self.log = logging.getLogger("posttid")
+
+    def missing_email(self):
+        self.log.error("No email found.")
+
+    def connection(self):
+        self.log.info("Connected.")
+
+    def reconnect(self):
+        self.log.info("Reconnecting.")
+
+    def request_found(self, title):
+        self.log.info(u"Found %s", title)
+
+    def no_connection(self):
+        self.log.warning("No connection detected.")
+
+    def subreddit_noexists(self, subreddit):
+        self.log.error(u"%s subreddit does not exist.", subreddit)
+
+    def timeout(self):
+        self.log.warning("Unable to retrieve requests. Timed out.")
+
+    def http(self):
+        self.log.warning("Http error detected.")
+
+    def status(self, condition, color):
+        self.log.debug("Status %s.", condition)
+
+    def query_requests(self, keyword):
+        self.log.debug(u"Querying %s.", keyword)
+
+    def fetch_latency(self, listing, seconds):
+        self.log.debug(u"Fetched %s in %.2f seconds.", listing, seconds)
+
+
+def load_requests(path):
+    """
+    Reads requests from a JSON file holding a list of [keyword, subreddit, listing] entries.
+    :param path: Path of the file
+    :return: Requests keyed the same way as the request table
+    """
+    with open(path) as f:
+        return _requests(json.load(f))
+
+
+def load_users(path):
+    """
+    Reads the requests of many users from a JSON file holding an object of each email to its list of
+    [keyword, subreddit, listing] entries.
+    :param path: Path of the file
+    :return: Dictionary of each email to its requests
+    """
+    with open(path) as f:
+        return dict((email, _requests(entries)) for email, entries in json.load(f).iteritems())
+
+
+def _requests(entries):
+    return dict((keyword + subreddit + listing, (keyword, subreddit, listing)) for keyword, subreddit, listing in entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Poll Reddit for the requests without the user interface.")
+    parser.add_argument("--email", help="email to notify instead of the saved one")
+    parser.add_argument("--requests", help="JSON file of [keyword, subreddit, listing] entries to use instead of the "
+                                           "saved requests")
+    parser.add_argument("--users", help="JSON file of each email to its [keyword, subreddit, listing] entries, serving "
+                                        "many users instead of the saved one")
+    parser.add_argument("--concurrency", type=int, default=1, help="listings downloaded at the same time")
+    parser.add_argument("--digest", action="store_true", help="send the matches of a cycle as a single email")
+    parser.add_argument("--processes", type=int, default=0, help="processes the matching is sharded over")
+    parser.add_argument("--firehose", action="store_true", help="read the New listings from r/all/new, filtering by "
+                                                                "subreddit locally")
+    parser.add_argument("--no-drain", action="store_true", help="do not deliver the queued emails when stopping")
+    parser.add_argument("--verbose", action="store_true", help="log every query")
+    parser.add_argument("--events", help="file the fetch, match and error events are appended to as JSON lines")
+    parser.add_argument("--events-socket", help="Unix socket the events are streamed to as JSON lines")
+    parser.add_argument("--events-webhook", help="URL the events are posted to in batches of JSON lines")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this local port")
+    parser.add_argument("--stats-interval", type=int, help="log the metrics every this many seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.DEBUG if args.verbose else logging.INFO)
+
+    data, email, requests = store.load()
+    if args.email:
+        email = args.email
+    if args.requests:
+        requests = load_requests(args.requests)
+
+    events = EventStream()
+    if args.events:
+        events.add(JSONLinesSink(args.events))
+    if args.events_socket:
+        events.add(UnixSocketSink(args.events_socket))
+    if args.events_webhook:
+        events.add(WebhookSink(args.events_webhook))
+
+    # The metrics server's thread is started after the engine has forked any shard processes.
+    metrics = Metrics()
+    engine = Engine(LogListener(), concurrency=args.concurrency, digest=args.digest, events=events, metrics=metrics,
+                    firehose=args.firehose, processes=args.processes)
+    if args.metrics_port:
+        MetricsServer(metrics, args.metrics_port).start()
+    if args.users:
+        engine.set_users(load_users(args.users))
+    else:
+        engine.set_values(email, requests)
+
+    # The engine runs on its own thread so that the main thread stays free to handle SIGINT and SIGTERM.
+    thread = threading.Thread(target=engine.run)
+    thread.daemon = True
+    thread.start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: engine.stop())
+
+    next_stats = time.time() + (args.stats_interval or 0)
+    try:
+        while thread.is_alive():
+            thread.join(1)
+            if args.stats_interval and time.time() >= next_stats:
+                logging.getLogger("posttid").info("Stats: %s", metrics.summary())
+                next_stats += args.stats_interval
+    except KeyboardInterrupt:
+        engine.stop()
+        thread.join(30)
+    engine.close(drain=not args.no_drain)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,33 @@
+from collections import deque
+
+from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import QPlainTextEdit
-from PyQt5.QtGui import QTextOption
+from PyQt5.QtGui import QColor, QFont, QTextCharFormat, QTextCursor, QTextOption
 
 from time import strftime
 
+# Milliseconds between insertions of the buffered entries.
+FLUSH_INTERVAL = 250
+# Buffered entries past which debug entries are sampled, keeping one in DEBUG_SAMPLE.
+DEEP_QUEUE = 200
+DEBUG_SAMPLE = 50
+
+DEBUG, INFO, MATCH, ERROR = range(4)
+
+
+def _format(color=None, bold=False):
+    text_format = QTextCharFormat()
+    if color:
+        text_format.setForeground(QColor(color))
+    if bold:
+        text_format.setFontWeight(QFont.Bold)
+    return text_format
+
 
 class LogViewer(QPlainTextEdit):
     """
-    The viewer which displays the results from the requests.
+    The viewer which displays the results from the requests. Entries are buffered and inserted as plain text on a timer,
+    a batch at a time, so a busy worker does not flood the event loop with a document change per entry.
     """
     def __init__(self, parent=None):
         super(LogViewer, self).__init__(parent)
@@ -18,74 +39,144 @@ class LogViewer(QPlainTextEdit):
         self.setMaximumBlockCount(10000)
 
         self.counter = 0
+        # Entries of [level, time, message, repeats] waiting to be inserted. Older entries are dropped once more are
+        # waiting than the viewer can show.
+        self.pending = deque(maxlen=self.maximumBlockCount())
+        self.sampled = 0
+        self.formats = {DEBUG: _format("gray"), INFO: _format(), MATCH: _format(bold=True), ERROR: _format("red")}
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(FLUSH_INTERVAL)
+        self.timer.timeout.connect(self.flush)
+        self.timer.start()
 
     def introduction(self):
-        self.appendHtml("************<br/>* <b>Welcome</b> *<br/>************<br/>")
+        self._log("************", stamp=False)
+        self._log("* Welcome *", MATCH, stamp=False)
+        self._log("************", stamp=False)
 
     def entries(self, count):
-        time = self.time()
         if count == 0:
-            self.appendHtml("{0} - No requests found.".format(time))
+            self._log("No requests found.")
         elif count == 1:
-            self.appendHtml("{0} - {1} request found.".format(time, count))
+            self._log("{0} request found.".format(count))
         else:
-            self.appendHtml("{0} - {1} requests found.".format(time, count))
+            self._log("{0} requests found.".format(count))
 
     def no_connection(self):
-        self.appendHtml("{0} - No connection detected.".format(self.time()))
-        self.appendHtml("{0} - Disconnected.".format(self.time()))
+        self._log("No connection detected.", ERROR)
+        self._log("Disconnected.", ERROR)
 
     def connection(self):
-        self.appendHtml("{0} - Connection detected.".format(self.time()))
-        self.appendHtml("{0} - Connected.".format(self.time()))
+        self._log("Connection detected.")
+        self._log("Connected.")
 
     def reconnect(self):
-        self.appendHtml("{0} - Connection detected.".format(self.time()))
-        self.appendHtml("{0} - Reconnecting.".format(self.time()))
+        self._log("Connection detected.")
+        self._log("Reconnecting.")
 
     def disabled(self):
-        self.appendHtml("{0} - Disabled.".format(self.time()))
+        self._log("Disabled.")
 
     def enabled(self):
-        self.appendHtml("{0} - Enabled.".format(self.time()))
+        self._log("Enabled.")
 
     def missing_email(self):
-        self.appendHtml("{0} - No email found.".format(self.time()))
+        self._log("No email found.", ERROR)
 
     def inserted(self, inserted_list):
-        self.appendHtml("{0} - Added {1} requests.".format(self.time(), len(inserted_list)))
-        self.appendHtml(self._html_list(inserted_list))
+        self._log("Added {0} requests.".format(len(inserted_list)))
+        self._list(inserted_list)
 
     def removed(self, removed_list):
-        self.appendHtml("{0} - Removed {1} requests.".format(self.time(), len(removed_list)))
-        self.appendHtml(self._html_list(removed_list))
+        self._log("Removed {0} requests.".format(len(removed_list)))
+        self._list(removed_list)
 
-    def request_found(self, item):
-        self.appendHtml(u"{0} - {1}".format(self.time(), item))
+    def log_event(self, item):
+        if item.kind == 'match':
+            self._log(u"{0} - r/{1} | {2}".format(item.title, item.subreddit, item.keyword), MATCH)
 
     def subreddit_noexists(self, subreddit):
-        self.appendHtml(u"{0} - {1} subreddit does not exist.".format(self.time(), subreddit))
+        self._log(u"{0} subreddit does not exist.".format(subreddit), ERROR)
 
     def timeout(self):
-        self.appendHtml("{} - Unable to retrieve requests. Timed out. Retrying in 60 seconds.".format(self.time()))
+        self._log("Unable to retrieve requests. Timed out. Retrying the listing after a backoff.", ERROR)
 
     def http(self):
-        self.appendHtml("{} - Http error detected.".format(self.time()))
+        self._log("Http error detected.", ERROR)
 
     @staticmethod
     def time():
-        return strftime("<i>%l:%M%p on %x</i>")
+        return strftime("%H:%M:%S")
 
-    @staticmethod
-    def _html_list(request_list):
-        html = ""
+    def _list(self, request_list):
         for (key, value) in request_list.iteritems():
-            html += u"&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&#9702; Keyword: {0} | Subreddit: {1} | Listing: {2}<br/>".format(
-                value[0], value[1], value[2])
-        return html
+            self._log(u"    \u25e6 Keyword: {0} | Subreddit: {1} | Listing: {2}".format(value[0], value[1], value[2]),
+                      stamp=False)
 
     def inside_loop(self):
-        self.appendHtml("...")
+        self._log("...", DEBUG)
 
     def query_requests(self, keyword):
-        self.appendHtml(u"{0} - Querying {1}.".format(self.time(), keyword))
+        self._log(u"Querying {0}.".format(keyword), DEBUG)
+
+    def fetch_latency(self, listing, seconds):
+        self._log(u"Fetched {0} in {1:.2f} seconds.".format(listing, seconds), DEBUG)
+
+    def _log(self, message, level=INFO, stamp=True):
+        """
+        Buffers an entry until the next flush.
+        :param message: Text of the entry
+        :param level: DEBUG, INFO, MATCH or ERROR, which picks the entry's color
+        :param stamp: Prefix the entry with the time
+        """
+        # Repeats of the last entry, such as the dots of each post, are counted on one line.
+        if self.pending and self.pending[-1][0] == level and self.pending[-1][2] == message:
+            self.pending[-1][3] += 1
+            return
+
+        if level == DEBUG and len(self.pending) >= DEEP_QUEUE:
+            self.sampled += 1
+            if self.sampled % DEBUG_SAMPLE:
+                return
+
+        self.pending.append([level, self.time() if stamp else None, message, 1])
+
+    def flush(self):
+        """
+        Inserts the buffered entries into the document in one edit, with a single change of format per run of entries
+        at the same level.
+        """
+        if not self.pending:
+            return
+
+        entries = list(self.pending)
+        self.pending.clear()
+
+        scroll_bar = self.verticalScrollBar()
+        following = scroll_bar.value() == scroll_bar.maximum()
+
+        cursor = QTextCursor(self.document())
+        cursor.movePosition(QTextCursor.End)
+        cursor.beginEditBlock()
+        empty = self.document().isEmpty()
+        run_level, run = None, []
+        for level, time, message, repeats in entries:
+            line = message if time is None else u"{0} {1}".format(time, message)
+            if repeats > 1:
+                line = u"{0} (x{1})".format(line, repeats)
+            if level != run_level and run:
+                empty = self._insert(cursor, run, run_level, empty)
+                run = []
+            run_level = level
+            run.append(line)
+        self._insert(cursor, run, run_level, empty)
+        cursor.endEditBlock()
+
+        if following:
+            scroll_bar.setValue(scroll_bar.maximum())
+
+    def _insert(self, cursor, lines, level, empty):
+        text = u"\n".join(lines)
+        cursor.insertText(text if empty else u"\n" + text, self.formats[level])
+        return False
@@ -0,0 +1,476 @@
+import operator
+import re
+
+# Length of the character grams the terms are indexed under.
+GRAM = 3
+
+# Prefixes which make a word of a keyword match a field of the post other than its title, such as "flair:selling",
+# with the attribute of the post each reads. Fields are tried in this order, cheapest first: the selftext can be many
+# times longer than the rest of the post, so it is only searched for requests that nothing else has matched.
+FIELDS = (('title', 'title'), ('flair', 'link_flair_text'), ('domain', 'domain'), ('url', 'url'),
+          ('selftext', 'selftext'))
+
+# Numbers of the post a keyword can set a threshold on, such as "score>=100", with the attribute each reads.
+THRESHOLDS = (('score', 'score'), ('comments', 'num_comments'))
+
+# Words joining the parts of a keyword. They are only operators in capitals, so "or" and "not" stay plain words.
+AND = 'AND'
+OR = 'OR'
+NOT = 'NOT'
+
+# Parentheses, quoted phrases with an optional field prefix, and words.
+_TOKENS = re.compile(r'[()]|[^\s()"]*"[^"]*"?|[^\s()]+', re.UNICODE)
+_COMPARISONS = (('>=', operator.ge), ('<=', operator.le), ('>', operator.gt), ('<', operator.lt), ('=', operator.eq))
+_THRESHOLD = re.compile(r'^({0})({1})(-?\d+)$'.format('|'.join(name for name, _ in THRESHOLDS),
+                                                      '|'.join(symbol for symbol, _ in _COMPARISONS)), re.IGNORECASE)
+
+
+def compile_term(term):
+    """
+    Converts a single word of a keyword into a pattern that lets whitespace and punctuation appear between its letters.
+    :param term: Word from the keyword
+    :return: The pattern, or an empty string when nothing is left after stripping the word
+    """
+    stripped = re.sub('[^0-9A-Za-z%]', '', term)
+    return ''.join(re.escape(letter) + r'\s*\W?' for letter in stripped)
+
+
+def parse_term(word):
+    """
+    Splits a word of a keyword into the field it matches and the word itself. Words without a known prefix match the
+    title.
+    :param word: Word from the keyword
+    :return: (field, word)
+    """
+    prefix, separator, rest = word.partition(':')
+    if separator and rest and prefix.lower() in _ATTRIBUTES:
+        return prefix.lower(), rest
+    return 'title', word
+
+
+def normalize(text):
+    """
+    Lowercases the text and strips everything but letters and digits. A term's pattern can only match a title when the
+    normalized term is found in the normalized title, which makes this a cheap test before the pattern is tried.
+    :param text: Title or word from a keyword
+    """
+    return re.sub('[^0-9A-Za-z]', '', text).lower()
+
+
+def group_key(subreddit, listing):
+    """
+    Key under which requests watching the same listing of a subreddit are grouped.
+    :param subreddit: Subreddit of the request
+    :param listing: Hot, New, Rising, Controversial, Top
+    """
+    return subreddit.lower(), listing.lower()
+
+
+_ATTRIBUTES = dict(FIELDS)
+_ORDER = dict((field, position) for position, (field, _) in enumerate(FIELDS))
+
+
+def post_attributes(keyword):
+    """
+    :param keyword: Keyword of a request
+    :return: Attributes of the post other than its title which the keyword reads
+    """
+    attributes = set()
+    for token in _TOKENS.findall(keyword):
+        threshold = _THRESHOLD.match(token)
+        if threshold:
+            attributes.add(dict(THRESHOLDS)[threshold.group(1).lower()])
+        else:
+            field, _ = parse_term(token)
+            if field != 'title':
+                attributes.add(_ATTRIBUTES[field])
+    return attributes
+
+
+def parse_query(keyword, term):
+    """
+    Parses a keyword into a tree of predicates. Words next to each other must all match, OR matches either side, NOT
+    excludes what follows it, parentheses group, quotes keep a phrase together, and thresholds such as "score>=100" or
+    "comments>10" compare the numbers of the post as retrieved. Posts of a New listing are matched once, when they are
+    new, so thresholds are only useful on the listings which show the same posts again. Mistakes such as an unclosed
+    parenthesis are forgiven rather than rejected, since the keyword is whatever was typed in the request dialog.
+    :param keyword: Keyword of a request
+    :param term: Function returning the predicate of a (field, word) term, or None when the word has nothing to match
+    :return: The root predicate, or None when the keyword has nothing to match
+    """
+    parser = _Parser(_TOKENS.findall(keyword), term)
+    parts = []
+    while parser.peek() is not None:
+        parts.append(parser.parse_or())
+        # A closing parenthesis without an opening one is skipped.
+        if parser.peek() == ')':
+            parser.position += 1
+    return _combine(_And, parts)
+
+
+class _Parser(object):
+    def __init__(self, tokens, term):
+        self.tokens = tokens
+        self.term = term
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+
+    def parse_or(self):
+        parts = [self.parse_and()]
+        while self.peek() == OR:
+            self.position += 1
+            parts.append(self.parse_and())
+        return _combine(_Or, parts)
+
+    def parse_and(self):
+        parts = []
+        while self.peek() not in (None, OR, ')'):
+            if self.peek() == AND:
+                self.position += 1
+            else:
+                parts.append(self.parse_not())
+        return _combine(_And, parts)
+
+    def parse_not(self):
+        if self.peek() == NOT:
+            self.position += 1
+            part = self.parse_not()
+            return _Not(part) if part is not None else None
+        return self.parse_primary()
+
+    def parse_primary(self):
+        token = self.peek()
+        if token in (None, OR, ')'):
+            return None
+        self.position += 1
+        if token == '(':
+            part = self.parse_or()
+            if self.peek() == ')':
+                self.position += 1
+            return part
+
+        threshold = _THRESHOLD.match(token)
+        if threshold:
+            name, symbol, value = threshold.groups()
+            return _Threshold(dict(THRESHOLDS)[name.lower()], dict(_COMPARISONS)[symbol], int(value))
+        # The quotes of a phrase are stripped along with the other punctuation when its pattern is compiled.
+        return self.term(*parse_term(token))
+
+
+def _combine(kind, parts):
+    parts = [part for part in parts if part is not None]
+    if not parts:
+        return None
+    return parts[0] if len(parts) == 1 else kind(parts)
+
+
+def _weight(anchors):
+    # Cheaper fields first, then fewer terms, then longer terms, which fewer titles contain.
+    return max(anchor.cost for anchor in anchors), len(anchors), -min(len(anchor.normalized) for anchor in anchors)
+
+
+class _And(object):
+    """
+    Matches when every part matches, trying the cheapest parts first.
+    """
+    __slots__ = ('parts', 'cost')
+
+    def __init__(self, parts):
+        self.parts = sorted(parts, key=lambda part: part.cost)
+        self.cost = sum(part.cost for part in parts)
+
+    def test(self, post):
+        return all(part.test(post) for part in self.parts)
+
+    def anchors(self):
+        # Any part which can only match through its terms will do, and the one with the cheapest, fewest terms is kept.
+        anchors = [part.anchors() for part in self.parts]
+        anchors = [part for part in anchors if part is not None]
+        return min(anchors, key=_weight) if anchors else None
+
+
+class _Or(object):
+    """
+    Matches when any part matches, trying the cheapest parts first.
+    """
+    __slots__ = ('parts', 'cost')
+
+    def __init__(self, parts):
+        self.parts = sorted(parts, key=lambda part: part.cost)
+        self.cost = sum(part.cost for part in parts)
+
+    def test(self, post):
+        return any(part.test(post) for part in self.parts)
+
+    def anchors(self):
+        anchors = set()
+        for part in self.parts:
+            part = part.anchors()
+            if part is None:
+                return None
+            anchors.update(part)
+        return frozenset(anchors)
+
+
+class _Not(object):
+    __slots__ = ('part', 'cost')
+
+    def __init__(self, part):
+        self.part = part
+        self.cost = part.cost
+
+    def test(self, post):
+        return not self.part.test(post)
+
+    def anchors(self):
+        return None
+
+
+class _Threshold(object):
+    """
+    Compares a number of the post, such as its score, with a fixed value. Posts without the number never match.
+    """
+    __slots__ = ('attribute', 'compare', 'value')
+    cost = 0
+
+    def __init__(self, attribute, compare, value):
+        self.attribute = attribute
+        self.compare = compare
+        self.value = value
+
+    def test(self, post):
+        actual = post.value(self.attribute)
+        return actual is not None and self.compare(actual, self.value)
+
+    def anchors(self):
+        return None
+
+
+class _Term(object):
+    """
+    A word or phrase used by one or more keywords in one field, with its pattern and the queries it anchors in the
+    index. The pattern is compiled the first time a post gets past the index, since most words of a large request set
+    never do.
+    """
+    __slots__ = ('field', 'normalized', 'pattern', 'compiled', 'cost', 'queries')
+
+    def __init__(self, field, normalized, pattern):
+        self.field = field
+        self.normalized = normalized
+        self.pattern = pattern
+        self.compiled = None
+        self.cost = _ORDER[field] + 1
+        self.queries = []
+
+    def search(self, title):
+        if self.compiled is None:
+            self.compiled = re.compile(self.pattern, re.IGNORECASE)
+        return self.compiled.search(title)
+
+    def test(self, post):
+        if self in post.found:
+            return True
+        text, normalized = post.text(self.field)
+        return bool(text) and self.normalized in normalized and self.search(text) is not None
+
+    def anchors(self):
+        return frozenset((self,))
+
+
+class _Query(object):
+    """
+    A keyword parsed once for a listing, with the requests using it.
+    """
+    __slots__ = ('root', 'requests')
+
+    def __init__(self, root):
+        self.root = root
+        self.requests = []
+
+
+class _Post(object):
+    """
+    Fields of the post being matched, each read and normalized the first time a predicate needs it, and the terms
+    already found in them through the index.
+    """
+    __slots__ = ('title', 'post', 'texts', 'found')
+
+    def __init__(self, title, post):
+        self.title = title
+        self.post = post
+        self.texts = {}
+        self.found = set()
+
+    def text(self, field):
+        text = self.texts.get(field)
+        if text is None:
+            if field == 'title':
+                raw = self.title
+            else:
+                raw = getattr(self.post, _ATTRIBUTES[field], None) if self.post is not None else None
+            raw = raw or u''
+            text = self.texts[field] = raw, normalize(raw)
+        return text
+
+    def value(self, attribute):
+        return getattr(self.post, attribute, None) if self.post is not None else None
+
+
+class _Index(object):
+    """
+    Inverted index of the terms of the requests watching one listing in one field, from character grams to the terms
+    containing them. Terms are matched anywhere in a title, even inside a longer word or spread over several, so titles
+    are looked up by their grams rather than by whole words.
+    """
+    def __init__(self, field='title'):
+        self.field = field
+        self.grams = {}
+        self.short = {}
+        self.unindexed = []
+        self.queries = set()
+
+    def add(self, term):
+        if len(term.normalized) >= GRAM:
+            self.grams.setdefault(term.normalized[:GRAM], []).append(term)
+        elif term.normalized:
+            self.short.setdefault(term.normalized, []).append(term)
+        else:
+            # Terms such as "%" have no letters or digits to look up and are tried on every title.
+            self.unindexed.append(term)
+
+    def candidates(self, normalized):
+        """
+        :param normalized: Normalized title
+        :return: The terms which could match the title
+        """
+        candidates = set(self.unindexed)
+        grams = self.grams
+        for start in xrange(len(normalized) - GRAM + 1):
+            terms = grams.get(normalized[start:start + GRAM])
+            if terms:
+                candidates.update(terms)
+
+        if self.short:
+            for length in xrange(1, GRAM):
+                for start in xrange(len(normalized) - length + 1):
+                    terms = self.short.get(normalized[start:start + length])
+                    if terms:
+                        candidates.update(terms)
+        return candidates
+
+
+class _Listing(object):
+    """
+    Indexes of the requests watching one listing, cheapest field first, and the queries which no term is required by,
+    such as "NOT meta" or "score>1000", which are tested on every post.
+    """
+    def __init__(self):
+        self.indexes = {}
+        self.unanchored = []
+
+
+class KeywordMatcher(object):
+    """
+    Parses every request's keyword once into a tree of predicates, and indexes for each query the terms it cannot
+    match without, so that matching a title costs a lookup per character of the title rather than a scan per keyword.
+    Only the queries whose terms are found through the index are tested on the post, cheapest predicates first. Terms
+    keep the fuzzy matching of letters separated by whitespace or punctuation, and words naming another field, such as
+    "domain:ebay.com", are indexed separately and only looked up in that field.
+    """
+    def __init__(self, requests=None):
+        self.listings = {}
+        self.order = {}
+        self.compile(requests or {})
+
+    def compile(self, requests):
+        """
+        Builds the index of each subreddit, listing and field, sharing one query between requests using the same keyword
+        and one pattern between queries using the same word.
+        :param requests: User's requests
+        """
+        listings = {}
+        queries = {}
+        terms = {}
+        self.order = {}
+        for key, (keyword, subreddit, listing) in requests.iteritems():
+            self.order[key] = len(self.order)
+            group = group_key(subreddit, listing)
+            query = queries.get((group, keyword))
+            if query is None:
+                def term(field, word):
+                    pattern = compile_term(word)
+                    if not pattern:
+                        return None
+                    if (group, field, pattern) not in terms:
+                        terms[(group, field, pattern)] = _Term(field, normalize(word), pattern)
+                    return terms[(group, field, pattern)]
+
+                root = parse_query(keyword, term)
+                if root is None:
+                    continue
+                query = queries[(group, keyword)] = _Query(root)
+
+                entry = listings.get(group)
+                if entry is None:
+                    entry = listings[group] = _Listing()
+                anchors = root.anchors()
+                if anchors is None:
+                    entry.unanchored.append(query)
+                for anchor in anchors or ():
+                    index = entry.indexes.get(anchor.field)
+                    if index is None:
+                        index = entry.indexes[anchor.field] = _Index(anchor.field)
+                    if not anchor.queries:
+                        index.add(anchor)
+                    anchor.queries.append(query)
+                    index.queries.add(query)
+            query.requests.append(key)
+
+        # Each listing's indexes are kept cheapest field first, in the order they are searched.
+        for entry in listings.itervalues():
+            entry.indexes = sorted(entry.indexes.values(), key=lambda index: _ORDER[index.field])
+        self.listings = listings
+
+    def match(self, title, subreddit, listing, post=None):
+        """
+        Finds every request watching the listing whose keyword matches the post. A field is only read and searched for
+        the queries which its cheaper fields have not made candidates already.
+        :param title: Title of the post
+        :param subreddit: Subreddit the post was retrieved from
+        :param listing: Listing the post was retrieved from
+        :param post: Post record the fields other than the title and the thresholds are read from, or None to match the
+        title alone
+        :return: Keys of the matching requests
+        """
+        entry = self.listings.get(group_key(subreddit, listing))
+        if not entry:
+            return []
+
+        fields = _Post(title, post)
+        candidates = set(entry.unanchored)
+        for index in entry.indexes:
+            if index.queries <= candidates:
+                continue
+            text, normalized = fields.text(index.field)
+            if not text:
+                continue
+            for term in index.candidates(normalized):
+                if term.normalized in normalized and term.search(text):
+                    fields.found.add(term)
+                    candidates.update(term.queries)
+
+        matches = set()
+        for query in candidates:
+            if query.root.test(fields):
+                matches.update(query.requests)
+        return sorted(matches, key=self.order.get)
+
+    def match_all(self, posts):
+        """
+        :param posts: List of (title, subreddit, listing) or (title, subreddit, listing, post)
+        :return: Keys of the matching requests of each post, in order
+        """
+        return [self.match(*post) for post in posts]
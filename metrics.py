@@ -0,0 +1,163 @@
+import BaseHTTPServer
+import threading
+import time
+
+# Upper bounds in seconds of the histogram buckets timings are counted in.
+BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+PREFIX = 'posttid_'
+# Port of the metrics endpoint when none is given, on the loopback interface only.
+DEFAULT_PORT = 9464
+
+
+class _Timer(object):
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.time() - self.started, **self.labels)
+
+
+class Metrics(object):
+    """
+    Counters, gauges and timing histograms of the engine, safe to update from any thread. Each metric is identified by
+    its name and labels, and rendered in the Prometheus text format.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        # (name, labels) to [count, sum, count per bucket]
+        self.timings = {}
+
+    def increment(self, name, amount=1, **labels):
+        key = name, tuple(sorted(labels.items()))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, seconds, **labels):
+        """
+        Counts a timing in its histogram.
+        :param name: Name of the histogram
+        :param seconds: Time taken
+        :param labels: Labels telling apart the timings of the same name, such as the stage
+        """
+        key = name, tuple(sorted(labels.items()))
+        with self.lock:
+            timing = self.timings.get(key)
+            if timing is None:
+                timing = self.timings[key] = [0, 0.0, [0] * len(BUCKETS)]
+            timing[0] += 1
+            timing[1] += seconds
+            for number, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    timing[2][number] += 1
+                    break
+
+    def timer(self, name, **labels):
+        """
+        :return: Context manager observing the time spent inside it
+        """
+        return _Timer(self, name, labels)
+
+    def render(self):
+        """
+        :return: Every metric in the Prometheus text exposition format
+        """
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            timings = sorted((key, (count, total, list(buckets))) for key, (count, total, buckets)
+                             in self.timings.items())
+
+        lines = []
+        for kind, metrics in (('counter', counters), ('gauge', gauges)):
+            typed = set()
+            for (name, labels), value in metrics:
+                if name not in typed:
+                    typed.add(name)
+                    lines.append('# TYPE {0}{1} {2}'.format(PREFIX, name, kind))
+                lines.append('{0}{1}{2} {3}'.format(PREFIX, name, _labels(labels), value))
+
+        typed = set()
+        for (name, labels), (count, total, buckets) in timings:
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {0}{1} histogram'.format(PREFIX, name))
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, buckets):
+                cumulative += bucket
+                lines.append('{0}{1}_bucket{2} {3}'.format(PREFIX, name, _labels(labels + (('le', bound),)),
+                                                           cumulative))
+            lines.append('{0}{1}_bucket{2} {3}'.format(PREFIX, name, _labels(labels + (('le', '+Inf'),)), count))
+            lines.append('{0}{1}_sum{2} {3}'.format(PREFIX, name, _labels(labels), total))
+            lines.append('{0}{1}_count{2} {3}'.format(PREFIX, name, _labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """
+        :return: One line of the counters, gauges and mean timings, for a periodic stats dump
+        """
+        with self.lock:
+            parts = ['{0}{1}={2}'.format(name, _labels(labels), value)
+                     for (name, labels), value in sorted(self.counters.items()) + sorted(self.gauges.items())]
+            parts += ['{0}{1}={2:.3f}s/{3}'.format(name, _labels(labels), total / count, count)
+                      for (name, labels), (count, total, _) in sorted(self.timings.items())]
+        return ' '.join(parts)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(u'{0}="{1}"'.format(name, unicode(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in labels) + '}'
+
+
+class MetricsServer(object):
+    """
+    Serves the metrics in the Prometheus text format at /metrics on a local port, from a daemon thread.
+    """
+    def __init__(self, metrics, port=DEFAULT_PORT, host='127.0.0.1'):
+        """
+        :param metrics: Metrics to serve
+        :param port: Port to listen on
+        :param host: Interface to listen on
+        """
+        self.metrics = metrics
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split('?')[0] not in ('/', '/metrics'):
+                    handler.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                handler.send_response(200)
+                handler.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, *args):
+                pass
+
+        self.server = BaseHTTPServer.HTTPServer((host, port), Handler)
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,315 @@
+import json
+import Queue
+import smtplib
+import socket
+import threading
+import time
+
+from collections import namedtuple
+from email.header import Header
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from os import getcwd
+
+from metrics import Metrics
+
+SMTP_HOST = 'smtp.gmail.com'
+SMTP_PORT = 587
+SMTP_USER = 'posditsmtp'
+SMTP_PASSWORD = 'posditpassword'
+SENDER = 'posditsmtp@gmail.com'
+# Seconds a connection may sit idle before it is checked with a NOOP ahead of the next message.
+KEEPALIVE = 60
+# Notifications waiting for the sender thread before new ones go straight to the dead letter log.
+QUEUE_SIZE = 1000
+# Attempts at delivering a message, waiting BACKOFF seconds after the first failure and doubling after each one.
+ATTEMPTS = 5
+BACKOFF = 2
+
+# A post which matched one of the requests.
+Match = namedtuple('Match', 'title keyword subreddit listing link reddit_link post_id')
+
+
+class SMTPSession(object):
+    """
+    Authenticated SMTP connection which is kept open between messages and reopened when the server drops it.
+    """
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, user=SMTP_USER, password=SMTP_PASSWORD, starttls=True,
+                 keepalive=KEEPALIVE):
+        """
+        :param host: SMTP server
+        :param port: SMTP port
+        :param user: Login user, or None to skip logging in
+        :param password: Login password
+        :param starttls: Upgrade the connection to TLS before logging in
+        :param keepalive: Seconds idle before the connection is checked
+        """
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.keepalive = keepalive
+        self.server = None
+        self.last_used = 0
+
+    def sendmail(self, sender, recipient, text):
+        """
+        Sends a message, reconnecting once if the connection turns out to be closed.
+        :param sender: From address
+        :param recipient: To address
+        :param text: The whole message
+        """
+        for attempt in range(2):
+            if not self._alive():
+                self.connect()
+            try:
+                self.server.sendmail(sender, recipient, text)
+                self.last_used = time.time()
+                return
+            except (smtplib.SMTPServerDisconnected, socket.error):
+                self.close()
+                if attempt:
+                    raise
+
+    def connect(self):
+        """
+        Opens the connection and runs EHLO, STARTTLS and LOGIN.
+        """
+        self.close()
+        server = smtplib.SMTP(self.host, self.port)
+        server.ehlo()
+        if self.starttls:
+            server.starttls()
+            server.ehlo()
+        if self.user:
+            server.login(self.user, self.password)
+        self.server = server
+        self.last_used = time.time()
+
+    def close(self):
+        if self.server:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, socket.error):
+                self.server.close()
+            self.server = None
+
+    def _alive(self):
+        if not self.server:
+            return False
+        if time.time() - self.last_used < self.keepalive:
+            return True
+        try:
+            return self.server.noop()[0] == 250
+        except (smtplib.SMTPServerDisconnected, socket.error):
+            return False
+
+
+class Notifier(object):
+    """
+    Sends the email notifications of matching posts, either one message per post or one digest per cycle.
+    """
+    def __init__(self, session=None, digest=False, sender=SENDER, delivered=None):
+        """
+        :param session: SMTP session to send through
+        :param digest: Hold the matches until flush and send them as a single message
+        :param sender: From address
+        :param delivered: Called with the email and the list of matches after each message is sent
+        """
+        self.session = session or SMTPSession()
+        self.digest = digest
+        self.sender = sender
+        self.delivered = delivered
+        self.pending = {}
+
+    def notify(self, email, match):
+        """
+        Sends, or holds for the digest, the notification of a matching post.
+        :param email: User's email
+        :param match: The matching post
+        """
+        if self.digest:
+            self.pending.setdefault(email, []).append(match)
+        else:
+            self._send(email, match.title, self._body(match))
+            self._delivered(email, [match])
+
+    def flush(self, emails=None):
+        """
+        Sends the digests of the matches held since the last flush.
+        :param emails: Users whose digests are sent, or None for every user
+        """
+        # Each digest is only dropped once sent, so a failed flush can be retried without repeating the others.
+        for email in self.pending.keys() if emails is None else [email for email in emails if email in self.pending]:
+            matches = self.pending[email]
+            if len(matches) == 1:
+                self._send(email, matches[0].title, self._body(matches[0]))
+            else:
+                subject = u"{0} new posts matching your requests".format(len(matches))
+                self._send(email, subject, u"<br /><br />".join(self._body(match) for match in matches))
+            del self.pending[email]
+            self._delivered(email, matches)
+
+    def close(self):
+        self.session.close()
+
+    def _delivered(self, email, matches):
+        if self.delivered:
+            self.delivered(email, matches)
+
+    def _send(self, email, subject, body):
+        msg = MIMEMultipart()
+        msg['From'] = self.sender
+        msg['To'] = email
+        # Titles, keywords and links are often not ASCII.
+        msg['Subject'] = Header(subject, 'utf-8')
+        msg.attach(MIMEText(body, 'html', 'utf-8'))
+        self.session.sendmail(self.sender, email, msg.as_string())
+
+    @staticmethod
+    def _body(match):
+        return u"{0} - Keyword: {1} | Subreddit: {2} | Listing: {3}\n <br />Reddit Link: {4} <br />Link: {5}"\
+            .format(time.ctime(), match.keyword, match.subreddit, match.listing, match.reddit_link, match.link)
+
+
+class SendQueue(object):
+    """
+    Bounded queue of notifications drained by a sender thread, so that polling never waits on the mail server. Messages
+    which cannot be delivered are appended to a dead letter log as JSON lines.
+    """
+    _stop = object()
+
+    def __init__(self, notifier, size=QUEUE_SIZE, attempts=ATTEMPTS, backoff=BACKOFF, dead_letters=None, metrics=None):
+        """
+        :param notifier: Notifier which sends the messages
+        :param size: Notifications held before new ones are dead lettered
+        :param attempts: Attempts at delivering a message
+        :param backoff: Seconds waited after the first failed attempt, doubled after each one
+        :param dead_letters: File undelivered notifications are appended to
+        :param metrics: Metrics the deliveries are counted and timed in
+        """
+        self.notifier = notifier
+        self.queue = Queue.Queue(size)
+        self.attempts = attempts
+        self.backoff = backoff
+        self.dead_letters = dead_letters or getcwd() + '/undelivered.log'
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.metrics = metrics or Metrics()
+
+    def start(self):
+        """
+        Starts the sender thread if it is not already running.
+        """
+        if self.thread and self.thread.is_alive():
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, email, match):
+        """
+        Queues the notification of a matching post without waiting.
+        :param email: User's email
+        :param match: The matching post
+        """
+        try:
+            self.queue.put_nowait((email, match))
+        except Queue.Full:
+            self._dead_letter([(email, match)], "Queue full")
+
+    def flush(self):
+        """
+        Queues the sending of the digests held so far.
+        """
+        try:
+            self.queue.put_nowait(None)
+        except Queue.Full:
+            pass
+
+    def stop(self, drain=True, timeout=None):
+        """
+        Stops the sender thread.
+        :param drain: Deliver the queued notifications first, otherwise they are dead lettered
+        :param timeout: Seconds to wait for the thread to finish
+        """
+        if not self.thread or not self.thread.is_alive():
+            return
+        if not drain:
+            self.stopping.set()
+        self.queue.put(self._stop)
+        self.thread.join(timeout)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is self._stop:
+                break
+            if self.stopping.is_set():
+                if item:
+                    self._dead_letter([item], "Stopped")
+                continue
+
+            if item:
+                email, match = item
+                error = self._deliver(lambda: self.notifier.notify(email, match))
+                if error:
+                    self._dead_letter([item], error)
+            else:
+                # Each user's digest is delivered on its own, so one which cannot be sent does not hold up the others.
+                for email in self.notifier.pending.keys():
+                    error = self._deliver(lambda: self.notifier.flush([email]))
+                    if error:
+                        self._dead_letter(self._take_pending([email]), error)
+
+        # Nothing is left behind in the digest once the thread stops.
+        if self.notifier.pending and not self.stopping.is_set():
+            self._deliver(self.notifier.flush)
+        self._dead_letter(self._take_pending(), "Stopped")
+        self.notifier.close()
+
+    def _deliver(self, send):
+        """
+        Sends with retries, waiting longer after each failure.
+        :param send: Function which sends the message
+        :return: The last error, or None once delivered
+        """
+        delay = self.backoff
+        for attempt in range(self.attempts):
+            try:
+                with self.metrics.timer('stage_seconds', stage='send'):
+                    send()
+                self.metrics.increment('sends_total')
+                return None
+            except (smtplib.SMTPException, socket.error) as error:
+                self.metrics.increment('send_errors_total', type=type(error).__name__)
+                if attempt == self.attempts - 1 or self.stopping.wait(delay):
+                    return repr(error)
+                delay *= 2
+            except Exception as error:
+                # Any other error, such as a message which cannot be built, would fail the same way again, so it is
+                # not retried and never stops the sender thread.
+                self.metrics.increment('send_errors_total', type=type(error).__name__)
+                return repr(error)
+
+    def _take_pending(self, emails=None):
+        """
+        Takes the matches held for the digests out of the notifier.
+        :param emails: Users whose matches are taken, or None for every user
+        :return: List of (email, match)
+        """
+        emails = self.notifier.pending.keys() if emails is None else emails
+        return [(email, match) for email in emails for match in self.notifier.pending.pop(email, [])]
+
+    def _dead_letter(self, items, error):
+        if not items:
+            return
+        self.metrics.increment('notifications_dead_lettered_total', len(items))
+        with self.lock:
+            with open(self.dead_letters, 'a') as f:
+                for email, match in items:
+                    entry = dict(match._asdict(), email=email, error=error, time=time.time())
+                    f.write(json.dumps(entry) + '\n')
@@ -125,6 +125,11 @@ class RequestDialog(QDialog):
     def set_up_request_dialog(self):
         keyword_label = QLabel("Keyword ")
         self.keyword_edit = QLineEdit()
+        self.keyword_edit.setToolTip("Every word must match the title, such as gpu 3080. Use OR, NOT, parentheses and "
+                                     "\"quoted phrases\", prefix a word with flair:, domain:, url: or selftext: to "
+                                     "match that part of the post instead, and set thresholds such as score>=100 or "
+                                     "comments>10 on listings other than New, which checks each post only once when "
+                                     "it is new.")
 
         subreddit_label = QLabel("Subreddit ")
         self.subreddit_edit = QLineEdit()
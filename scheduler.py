@@ -0,0 +1,163 @@
+import heapq
+import random
+import threading
+import time
+
+# Bounds of the seconds between two polls of the same listing, and the interval used until its activity is known.
+MIN_INTERVAL = 15
+MAX_INTERVAL = 600
+DEFAULT_INTERVAL = 60
+# Listing requests per minute allowed across the whole schedule, within Reddit's limit for clients without OAuth.
+REQUESTS_PER_MINUTE = 30
+# New posts a listing should have gathered by the time it is polled again.
+TARGET_POSTS = 5
+# Weight of the latest poll in the moving average of a listing's arrival rate.
+SMOOTHING = 0.3
+# Share of a failed listing's backoff taken off at random, so listings failing together do not retry together.
+JITTER = 0.5
+
+
+class Scheduler(object):
+    """
+    Priority queue of the time each listing is next due, polling busy listings more often than quiet ones.
+    """
+    def __init__(self, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, budget=REQUESTS_PER_MINUTE,
+                 target=TARGET_POSTS):
+        """
+        :param min_interval: Fewest seconds between two polls of a listing
+        :param max_interval: Most seconds between two polls of a listing
+        :param budget: Listing requests per minute allowed across all listings
+        :param target: New posts a listing should have gathered when it is polled again
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.budget = budget
+        self.target = target
+        self.heap = []
+        self.next_due = {}
+        self.intervals = {}
+        self.rates = {}
+        self.polled = {}
+        self.last_posts = {}
+        self.failures = {}
+        self.lock = threading.Lock()
+
+    def update(self, keys):
+        """
+        Replaces the scheduled listings. Listings already scheduled keep their state and new ones are due at once.
+        :param keys: Keys of the listings
+        """
+        with self.lock:
+            keys = set(keys)
+            for state in (self.next_due, self.intervals, self.rates, self.polled, self.last_posts, self.failures):
+                for key in set(state) - keys:
+                    del state[key]
+
+            now = time.time()
+            for key in keys - set(self.next_due):
+                self.intervals[key] = min(max(DEFAULT_INTERVAL, self.min_interval), self.max_interval)
+                self._push(key, now)
+
+    def due(self, now=None):
+        """
+        Takes the listings which are due. They are provisionally rescheduled a full interval later in case their poll
+        fails before it is recorded.
+        :return: Keys of the due listings
+        """
+        now = now or time.time()
+        keys = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                due, key = heapq.heappop(self.heap)
+                # Entries replaced by a later reschedule are left in the heap and skipped here.
+                if self.next_due.get(key) != due:
+                    continue
+                keys.append(key)
+                self._push(key, now + self.intervals[key])
+        return keys
+
+    def expedite(self, keys, now=None):
+        """
+        Makes listings due at once, such as those skipped when polling was paused part way through.
+        :param keys: Keys of the listings
+        """
+        now = now or time.time()
+        with self.lock:
+            for key in keys:
+                if key in self.next_due:
+                    self._push(key, now)
+
+    def wait_time(self, now=None):
+        """
+        :return: Seconds until the next listing is due, or None when nothing is scheduled
+        """
+        now = now or time.time()
+        with self.lock:
+            while self.heap and self.next_due.get(self.heap[0][1]) != self.heap[0][0]:
+                heapq.heappop(self.heap)
+            if not self.heap:
+                return None
+            return max(0, self.heap[0][0] - now)
+
+    def record(self, key, post_ids, now=None):
+        """
+        Records a poll of a listing and schedules the next one from the rate posts are arriving at.
+        :param key: Key of the listing
+        :param post_ids: Ids of the posts retrieved
+        """
+        now = now or time.time()
+        with self.lock:
+            if key not in self.next_due:
+                return
+
+            post_ids = set(post_ids)
+            if key in self.polled:
+                arrivals = len(post_ids - self.last_posts[key])
+                rate = arrivals / max(now - self.polled[key], 1.0)
+                self.rates[key] = SMOOTHING * rate + (1 - SMOOTHING) * self.rates.get(key, rate)
+                self._adapt()
+            self.polled[key] = now
+            self.last_posts[key] = post_ids
+            self.failures.pop(key, None)
+            self._push(key, now + self.intervals[key])
+
+    def fail(self, key, now=None):
+        """
+        Records a failed poll of a listing and retries it after a backoff, doubled after each failure in a row from the
+        shortest interval up to the longest, with jitter.
+        :param key: Key of the listing
+        :return: Seconds until the listing is retried, or None when it is no longer scheduled
+        """
+        now = now or time.time()
+        with self.lock:
+            if key not in self.next_due:
+                return None
+
+            failures = self.failures[key] = self.failures.get(key, 0) + 1
+            backoff = min(self.min_interval * 2 ** (failures - 1), self.max_interval)
+            backoff *= 1 - JITTER * random.random()
+            self._push(key, now + backoff)
+            return backoff
+
+    def _adapt(self):
+        # Intervals aim for the target number of new posts per poll, then are stretched evenly if the whole schedule
+        # would make more requests than the budget allows.
+        intervals = {}
+        for key in self.next_due:
+            rate = self.rates.get(key)
+            if rate is None:
+                interval = DEFAULT_INTERVAL
+            elif rate == 0:
+                interval = self.max_interval
+            else:
+                interval = self.target / rate
+            intervals[key] = min(max(interval, self.min_interval), self.max_interval)
+
+        requests_per_minute = sum(60.0 / interval for interval in intervals.itervalues())
+        scale = max(1.0, requests_per_minute / self.budget)
+        for key, interval in intervals.iteritems():
+            self.intervals[key] = interval * scale
+
+    def _push(self, key, due):
+        self.next_due[key] = due
+        heapq.heappush(self.heap, (due, key))
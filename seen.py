@@ -0,0 +1,95 @@
+import time
+
+from collections import OrderedDict
+
+
+class SeenPosts(object):
+    """
+    Bounded record of the posts which have already been checked, ordered from least to most recently seen.
+    """
+    def __init__(self, max_size=50000, max_age=None, compact=True, store=None, user=''):
+        """
+        :param max_size: Number of posts remembered before the least recently seen are evicted
+        :param max_age: Seconds a post is remembered after it was last seen, or None to only evict by size
+        :param compact: Store Reddit's base-36 ids as integers
+        :param store: Store the posts are saved to and loaded from, or None to keep them in memory only
+        :param user: Email of the user the posts were checked for
+        """
+        self.max_size = max_size
+        self.max_age = max_age
+        self.compact = compact
+        self.store = store
+        self.user = user
+        self.posts = OrderedDict()
+        # Posts added or seen again, and posts evicted, since the last save.
+        self.changed = {}
+        self.removed = set()
+
+    def __contains__(self, post_id):
+        key = self._encode(post_id)
+        if key not in self.posts:
+            return False
+
+        # Posts which keep showing up on a listing are moved to the back so they are not evicted while still listed.
+        del self.posts[key]
+        self.posts[key] = self.changed[key] = time.time()
+        return True
+
+    def __len__(self):
+        return len(self.posts)
+
+    def add(self, post_id):
+        """
+        Remembers a post and evicts the posts that are over the size or age bound.
+        :param post_id: Reddit's base-36 id of the post
+        """
+        key = self._encode(post_id)
+        self.posts.pop(key, None)
+        self.posts[key] = self.changed[key] = time.time()
+        self.removed.discard(key)
+        self._evict()
+
+    def _evict(self):
+        while len(self.posts) > self.max_size:
+            self._pop()
+
+        if self.max_age is not None:
+            expired = time.time() - self.max_age
+            while self.posts and next(iter(self.posts.itervalues())) < expired:
+                self._pop()
+
+    def _pop(self):
+        key = self.posts.popitem(last=False)[0]
+        self.changed.pop(key, None)
+        self.removed.add(key)
+
+    def _encode(self, post_id):
+        if self.compact:
+            try:
+                return int(post_id, 36)
+            except ValueError:
+                pass
+        return post_id
+
+    def save(self):
+        """
+        Writes the posts added, seen again or evicted since the last save to the store, in a single transaction so a
+        crash while saving leaves the previous state intact.
+        """
+        if self.store is None or not (self.changed or self.removed):
+            return
+
+        self.store.save_seen(self.user, self.changed.items(), self.removed)
+        self.changed = {}
+        self.removed = set()
+
+    def load(self):
+        """
+        Load in the posts saved by a previous run, if any. Only the posts within the size bound are read.
+        :return: The seen posts, for chaining on construction
+        """
+        self.posts = OrderedDict(self.store.load_seen(self.user, self.max_size) if self.store else ())
+        self.changed = {}
+        self.removed = set()
+        self._evict()
+        return self
@@ -0,0 +1,138 @@
+import multiprocessing
+import threading
+import zlib
+
+from matcher import KeywordMatcher, post_attributes
+
+
+def shard_of(subreddit, shards):
+    """
+    Shard owning the requests of a subreddit, the same in every process.
+    :param subreddit: Subreddit name in any case
+    :param shards: Number of shards
+    """
+    return (zlib.crc32(subreddit.lower().encode('utf-8')) & 0xffffffff) % shards
+
+
+class _Fields(object):
+    """
+    The fields of a post which a shard's requests read besides the title, standing in for the post record.
+    """
+    __slots__ = ('values',)
+
+    def __init__(self, values):
+        self.values = values
+
+    def __getattr__(self, name):
+        return self.values.get(name)
+
+
+def _serve(connection):
+    # Runs in each shard process: compiles the shard's requests and answers batches of posts with the matching keys.
+    matcher = KeywordMatcher()
+    attributes = ()
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        command, payload = message
+        if command == 'compile':
+            requests, attributes = payload
+            matcher.compile(requests)
+        else:
+            matches = []
+            for index, title, subreddit, listing, values in payload:
+                fields = _Fields(dict(zip(attributes, values))) if values is not None else None
+                keys = matcher.match(title, subreddit, listing, fields)
+                if keys:
+                    matches.append((index, keys))
+            connection.send(matches)
+    connection.close()
+
+
+class ShardedMatcher(object):
+    """
+    Keyword matcher split over worker processes by subreddit, so that matching is not bound to the one core the engine
+    runs on. Each process indexes the requests of its subreddits, receives the posts of those subreddits in one batch
+    per listing, with only the fields its requests read, and sends back only the matches.
+    """
+    def __init__(self, processes, requests=None):
+        """
+        :param processes: Number of shard processes
+        :param requests: Requests keyed the same way as the request table
+        """
+        self.shards = []
+        for _ in range(max(1, processes)):
+            connection, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_serve, args=(child,))
+            process.daemon = True
+            process.start()
+            child.close()
+            self.shards.append((process, connection))
+        self.order = {}
+        # Attributes of the post each shard's requests read besides the title.
+        self.attributes = [() for _ in self.shards]
+        # One batch or compile is in flight at a time, since the engine and the settings can both use the matcher.
+        self.lock = threading.Lock()
+        self.compile(requests or {})
+
+    def compile(self, requests):
+        """
+        Sends each shard the requests of its subreddits to index.
+        :param requests: User's requests
+        """
+        parts = [{} for _ in self.shards]
+        attributes = [set() for _ in self.shards]
+        order = {}
+        for key, request in requests.iteritems():
+            order[key] = len(order)
+            shard = shard_of(request[1], len(self.shards))
+            parts[shard][key] = request
+            attributes[shard].update(post_attributes(request[0]))
+        attributes = [tuple(sorted(names)) for names in attributes]
+
+        with self.lock:
+            for (process, connection), part, names in zip(self.shards, parts, attributes):
+                connection.send(('compile', (part, names)))
+            self.order = order
+            self.attributes = attributes
+
+    def match(self, title, subreddit, listing, post=None):
+        return self.match_all([(title, subreddit, listing, post)])[0]
+
+    def match_all(self, posts):
+        """
+        Matches a batch of posts on the shards at the same time.
+        :param posts: List of (title, subreddit, listing) or (title, subreddit, listing, post)
+        :return: Keys of the matching requests of each post, in order
+        """
+        results = [[] for _ in posts]
+        with self.lock:
+            shards = len(self.shards)
+            batches = {}
+            for index, post in enumerate(posts):
+                title, subreddit, listing = post[:3]
+                record = post[3] if len(post) > 3 else None
+                shard = shard_of(subreddit, shards)
+                # Only the fields the shard's requests read are sent, rather than the whole record.
+                values = None
+                if record is not None and self.attributes[shard]:
+                    values = tuple(getattr(record, name, None) for name in self.attributes[shard])
+                batches.setdefault(shard, []).append((index, title, subreddit, listing, values))
+
+            for shard, batch in batches.iteritems():
+                self.shards[shard][1].send(('match', batch))
+            for shard in batches:
+                for index, keys in self.shards[shard][1].recv():
+                    results[index] = keys
+            order = self.order
+        return [sorted(keys, key=order.get) for keys in results]
+
+    def close(self):
+        with self.lock:
+            for process, connection in self.shards:
+                connection.send(None)
+                connection.close()
+            for process, connection in self.shards:
+                process.join()
+            self.shards = []
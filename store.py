@@ -0,0 +1,237 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from os import getcwd
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS requests (
+    user TEXT NOT NULL,
+    key TEXT NOT NULL,
+    keyword TEXT NOT NULL,
+    subreddit TEXT NOT NULL,
+    listing TEXT NOT NULL,
+    PRIMARY KEY (user, key)
+);
+CREATE INDEX IF NOT EXISTS requests_listing ON requests (subreddit, listing);
+CREATE TABLE IF NOT EXISTS seen_posts (
+    user TEXT NOT NULL,
+    post_id NOT NULL,
+    seen_at REAL NOT NULL,
+    PRIMARY KEY (user, post_id)
+);
+CREATE INDEX IF NOT EXISTS seen_posts_age ON seen_posts (user, seen_at);
+CREATE TABLE IF NOT EXISTS cursors (
+    subreddit TEXT NOT NULL,
+    listing TEXT NOT NULL,
+    fullname TEXT,
+    empty INTEGER NOT NULL,
+    PRIMARY KEY (subreddit, listing)
+);
+CREATE TABLE IF NOT EXISTS notifications (
+    user TEXT NOT NULL,
+    post_id TEXT NOT NULL,
+    request TEXT NOT NULL,
+    sent_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notifications_post ON notifications (user, post_id);
+"""
+
+# Requests made in the window belong to this user, so they stay put when the email is changed.
+LOCAL_USER = ''
+
+
+class Store(object):
+    """
+    SQLite database of the requests, seen posts, listing cursors and delivered notifications. It is written in WAL mode
+    with small transactions, so that a crash loses at most the changes of the transaction in progress.
+    """
+    def __init__(self, path=None):
+        """
+        :param path: Database file, 'posttid.db' in the current working directory by default
+        """
+        self.path = path or getcwd() + '/posttid.db'
+        # The window, the worker and the email sender share the connection, taking turns through the lock.
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(SCHEMA)
+        self._migrate()
+
+    def load(self):
+        """
+        Load in saved email and requests on start.
+        :return: dictionary containing saved data or null if no saved data
+        """
+        email = self.setting("email") or ""
+        requests = self.load_requests(LOCAL_USER)
+        return dict(email=email, requests=requests), email, requests
+
+    def save(self, email, requests):
+        """
+        Saves the email and requests of the window.
+        :param email: Email to be saved
+        :param requests: Requests to be saved
+        """
+        self.set_setting("email", email)
+        self.save_requests(LOCAL_USER, requests)
+
+    def setting(self, name):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM settings WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_setting(self, name, value):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)", (name, value))
+
+    def load_requests(self, user):
+        """
+        :param user: Email of the user, or LOCAL_USER for the window's requests
+        :return: The user's requests keyed the same way as the request table
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT key, keyword, subreddit, listing FROM requests WHERE user = ?",
+                                           (user,)).fetchall()
+        return dict((key, (keyword, subreddit, listing)) for key, keyword, subreddit, listing in rows)
+
+    def save_requests(self, user, requests):
+        """
+        Writes only the requests which were added or removed since they were last saved.
+        :param user: Email of the user, or LOCAL_USER for the window's requests
+        :param requests: All of the user's requests
+        """
+        saved = self.load_requests(user)
+        removed = [(user, key) for key in saved if key not in requests]
+        changed = [(user, key) + tuple(request) for key, request in requests.iteritems()
+                   if saved.get(key) != tuple(request)]
+        with self.lock, self.connection:
+            self.connection.executemany("DELETE FROM requests WHERE user = ? AND key = ?", removed)
+            self.connection.executemany("INSERT OR REPLACE INTO requests (user, key, keyword, subreddit, listing) "
+                                        "VALUES (?, ?, ?, ?, ?)", changed)
+
+    def load_seen(self, user, limit):
+        """
+        Reads the most recently seen posts of a user and deletes any older ones.
+        :param user: Email of the user
+        :param limit: Most posts to read
+        :return: List of (post id, time seen), least recently seen first
+        """
+        with self.lock, self.connection:
+            rows = self.connection.execute("SELECT post_id, seen_at FROM seen_posts WHERE user = ? "
+                                           "ORDER BY seen_at DESC LIMIT ?", (user, limit)).fetchall()
+            if len(rows) == limit:
+                self.connection.execute("DELETE FROM seen_posts WHERE user = ? AND seen_at < ?", (user, rows[-1][1]))
+        rows.reverse()
+        return rows
+
+    def save_seen(self, user, changed, removed):
+        """
+        Writes the posts seen or evicted since the last save.
+        :param user: Email of the user
+        :param changed: List of (post id, time seen) which were added or seen again
+        :param removed: Ids of the evicted posts
+        """
+        with self.lock, self.connection:
+            self.connection.executemany("DELETE FROM seen_posts WHERE user = ? AND post_id = ?",
+                                        [(user, post_id) for post_id in removed])
+            self.connection.executemany("INSERT OR REPLACE INTO seen_posts (user, post_id, seen_at) VALUES (?, ?, ?)",
+                                        [(user, post_id, seen_at) for post_id, seen_at in changed])
+
+    def load_cursors(self):
+        """
+        :return: Dictionary of (subreddit, listing) to (newest fullname seen, empty responses in a row)
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT subreddit, listing, fullname, empty FROM cursors").fetchall()
+        return dict(((subreddit, listing), (fullname, empty)) for subreddit, listing, fullname, empty in rows)
+
+    def save_cursors(self, cursors):
+        """
+        Writes only the cursors which moved or were dropped since they were last saved.
+        :param cursors: Dictionary of (subreddit, listing) to (newest fullname seen, empty responses in a row)
+        """
+        saved = self.load_cursors()
+        cursors = dict(cursors)
+        removed = [key for key in saved if key not in cursors]
+        changed = [key + tuple(cursor) for key, cursor in cursors.iteritems() if saved.get(key) != tuple(cursor)]
+        with self.lock, self.connection:
+            self.connection.executemany("DELETE FROM cursors WHERE subreddit = ? AND listing = ?", removed)
+            self.connection.executemany("INSERT OR REPLACE INTO cursors (subreddit, listing, fullname, empty) "
+                                        "VALUES (?, ?, ?, ?)", changed)
+
+    def add_notifications(self, user, matches):
+        """
+        Records the delivered notifications.
+        :param user: Email the notifications were sent to
+        :param matches: The matches which were sent
+        """
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT INTO notifications (user, post_id, request, sent_at) "
+                                        "VALUES (?, ?, ?, ?)",
+                                        [(user, match.post_id, match.keyword, now) for match in matches])
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def _migrate(self):
+        """
+        Imports the email and requests of the 'tkl.pkl' file which the store replaces, once, and renames the file so
+        that it is not imported again. Only the file next to the database is read, so that a store opened elsewhere,
+        such as by the benchmark, never takes the application's settings.
+        """
+        legacy = os.path.join(os.path.dirname(os.path.abspath(self.path)), 'tkl.pkl')
+        if not os.path.exists(legacy):
+            return
+
+        try:
+            with open(legacy, 'rb') as f:
+                data = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return
+
+        if self.setting("email") is None:
+            self.save(data.get("email", ""), data.get("requests", {}))
+        os.rename(legacy, legacy + '.migrated')
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared():
+    """
+    :return: The store in the current working directory, opened on first use
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = Store()
+        return _shared
+
+
+def load():
+    """
+    Load in saved email and requests on start.
+    :return: dictionary containing saved data or null if no saved data
+    """
+    return shared().load()
+
+
+def save(email, requests):
+    """
+    Save the email and requests to the store in the current working directory.
+    :param email: Email to be saved
+    :param requests: Requests to be saved
+    """
+    shared().save(email, requests)
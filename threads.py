@@ -1,33 +1,12 @@
-import requests
-import praw
-import time
-import smtplib
-import re
-
 from PyQt5.QtCore import QThread, pyqtSignal
 
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-
-
-def run_once(function):
-    """
-    Allows the connect log message to be run only once on start up.
-    :param function: The connect method
-    :return: the wrapper to allowing it to be called again.
-    """
-    def wrapper(*args, **kwargs):
-        if not wrapper.has_run:
-            wrapper.has_run = True
-            return function(*args, **kwargs)
-
-    wrapper.has_run = False
-    return wrapper
+from engine import Engine, Listener
+from events import CallbackSink
 
 
 class Worker(QThread):
     """
-    Worker thread to retrieve requests from Reddit and relay the results to the log viewer.
+    Worker thread to run the engine and relay its progress to the log viewer through signals.
     """
     # Signal to log that there is no email found.
     missing_email_signal = pyqtSignal()
@@ -35,8 +14,6 @@ class Worker(QThread):
     connect_signal = pyqtSignal()
     # Signal to log successful reconnection.
     reconnect_signal = pyqtSignal()
-    # Signal to log successful requests found.
-    request_signal = pyqtSignal(str)
     # Signal to log when there is no internet connection.
     connectionerror_signal = pyqtSignal()
     # Signal to log when subreddit does not exist.
@@ -51,140 +28,88 @@ class Worker(QThread):
     test_inside_loop = pyqtSignal()
 
     test_query_requests = pyqtSignal(str)
+    # Signal to log how long a listing took to download.
+    fetch_latency_signal = pyqtSignal(str, float)
+    # Signal carrying each event of the engine's event stream, from which the log shows the matches found.
+    event_signal = pyqtSignal(object)
 
-    def __init__(self):
+    def __init__(self, concurrency=1, digest=False):
+        """
+        :param concurrency: Number of listings downloaded at the same time
+        :param digest: Send the matches of a cycle as a single email
+        """
         super(Worker, self).__init__()
-        self.initialize = True
-        self.reconnect = False
-        self.disable = False
-        self.previous_posts = []
+        self.engine = Engine(_SignalListener(self), concurrency=concurrency, digest=digest)
+        self.engine.events.add(CallbackSink(self.event_signal.emit))
 
     def __del__(self):
         self.wait()
 
     def run(self):
-        if self.email:
-            self.get_requests()
-        else:
-            self.missing_email_signal.emit()
-            self.status_condition_signal.emit("Down", "red")
+        self.engine.run()
 
-    def get_requests(self):
-        """
-        Retrieve the requests from Reddit.
-        """
+    def pause(self):
+        self.engine.pause()
 
-        while True:
+    def resume(self):
+        self.engine.resume()
 
-            while self.disable:
-                time.sleep(1)
-
-            connecting = run_once(self.connect)
-
-            try:
-                for key, (keyword, subreddit, listing) in self.requests.iteritems():
-
-                    reddit = praw.Reddit(user_agent="desktop:posttid:v1.0")
-                    subreddit_addr = reddit.get_subreddit(subreddit)
-                    request_method = getattr(subreddit_addr, 'get_{}'.format(listing.lower()))
-
-                    self.test_query_requests.emit(keyword)
-
-                    for post in request_method():
-                        # Connecting/Reconnecting log message
-                        #connecting(self.initialize, self.reconnect)
+    def stop(self, drain=True, timeout=30):
+        """
+        Stops polling, waits for the thread to finish and shuts down the email sender.
+        :param drain: Deliver the queued emails before stopping the sender
+        :param timeout: Seconds to wait for each of the thread and the sender to finish
+        """
+        self.engine.stop()
+        self.wait(timeout * 1000)
+        self.engine.close(drain=drain, timeout=timeout)
 
-                        self.test_inside_loop.emit()
+    def set_values(self, new_email, new_requests):
+        """
+        Updates the worker thread with new email and requests
+        :param new_email: User's email
+        :param new_requests: User's requests
+        :return:
+        """
+        self.engine.set_values(new_email, new_requests)
 
-                        phrases = keyword.split()
-                        for index, term in enumerate(phrases):
-                            phrases[index] = re.sub('[^0-9A-Za-z%]', '', term)
-                            phrases[index] = re.sub('(.)', '\\1\s*\W?', phrases[index])
 
+class _SignalListener(Listener):
+    """
+    Turns the engine's progress into the worker's signals, which Qt delivers on the user interface thread.
+    """
+    def __init__(self, worker):
+        self.worker = worker
 
-                        # Check if the post has been checked already. If not, send email notification and add it to the
-                        # checked list.
-                        for adjusted in phrases:
-                            if post.id not in self.previous_posts and re.search(adjusted, post.title, re.IGNORECASE):
-                                self._send_email(post.title, keyword, subreddit, listing, post.url, post.permalink)
-                                self.previous_posts.append(post.id)
-                                self.request_signal.emit(post.title)
+    def missing_email(self):
+        self.worker.missing_email_signal.emit()
 
-            # No internet error
-            except requests.ConnectionError:
-                self.connectionerror_signal.emit()
-                self.status_condition_signal.emit("Down", "red")
-                self.reconnect = True
-                connecting.has_run = False
+    def connection(self):
+        self.worker.connect_signal.emit()
 
-            # No such subreddit error
-            except praw.errors.InvalidSubreddit:
-                self.subreddit_noexist_signal.emit(subreddit)
-                self.status_condition_signal.emit("Down", "red")
-                self.reconnect = True
-                return
+    def reconnect(self):
+        self.worker.reconnect_signal.emit()
 
-            # Fail to get requests and time out
-            except requests.exceptions.ReadTimeout:
-                self.timeout_signal.emit()
+    def no_connection(self):
+        self.worker.connectionerror_signal.emit()
 
-            except praw.errors.HTTPException:
-                self.httperror_signal.emit()
+    def subreddit_noexists(self, subreddit):
+        self.worker.subreddit_noexist_signal.emit(subreddit)
 
-            else:
-                self.status_condition_signal.emit("Up", "green")
+    def timeout(self):
+        self.worker.timeout_signal.emit()
 
-            self.initialize = False
-            time.sleep(60)
+    def http(self):
+        self.worker.httperror_signal.emit()
 
-    def _send_email(self, subject, keyword, subreddit, listing, link, reddit_link):
-        """
-        Sends email notification when a post with the keyword in the title has been found.
-        :param subject: Title of the post
-        :param keyword: Keyword to be found
-        :param subreddit: Subreddit to check
-        :param listing: Hot, New, Rising, Controversial
-        :param link: Url of the store or item
-        :param reddit_link: Url of the reddit post
-        """
-        msg = MIMEMultipart()
-        msg['From'] = 'posditsmtp@gmail.com'
-        msg['To'] = self.email
-        msg['Subject'] = subject
-        body = u"{0} - Keyword: {1} | Subreddit: {2} | Listing: {3}\n <br />Reddit Link: {4} <br />Link: {5}"\
-            .format(time.ctime(), keyword, subreddit, listing, reddit_link, link)
-        msg.attach(MIMEText(body, 'html'))
-        text = msg.as_string()
-
-        server = smtplib.SMTP('smtp.gmail.com:587')
-        server.ehlo()
-        server.starttls()
-        server.login("posditsmtp", "posditpassword")
-        try:
-            server.sendmail('posditsmtp@gmail.com', self.email, text)
-        except smtplib.SMTPAuthenticationError:
-            pass
-        server.close()
+    def status(self, condition, color):
+        self.worker.status_condition_signal.emit(condition, color)
 
-    def set_values(self, new_email, new_requests):
-        """
-        Updates the worker thread with new email and requests
-        :param new_email: User's email
-        :param new_requests: User's requests
-        :return:
-        """
-        self.email = new_email
-        self.requests = new_requests
+    def inside_loop(self):
+        self.worker.test_inside_loop.emit()
 
-    def connect(self, initialize, reconnect):
-        """
-        Checks whether the program has recently started or is resuming from a disconnect.
-        :param initialize: Recently started?
-        :param reconnect: Recently disconnected?
-        """
-        if initialize:
-            self.connect_signal.emit()
-        elif reconnect:
-            self.reconnect_signal.emit()
-            self.reconnect = False
+    def query_requests(self, keyword):
+        self.worker.test_query_requests.emit(keyword)
 
+    def fetch_latency(self, listing, seconds):
+        self.worker.fetch_latency_signal.emit(listing, seconds)
@@ -0,0 +1,174 @@
+import threading
+import time
+
+from collections import OrderedDict
+from praw.handlers import DefaultHandler
+from requests.adapters import HTTPAdapter
+
+from metrics import Metrics
+
+# Requests per second allowed across every fetch thread, matching the two second delay praw keeps between requests.
+DEFAULT_RATE = 0.5
+# Seconds a listing response is reused for identical requests. Kept under the scheduler's shortest interval so a
+# listing polled again is always downloaded again.
+CACHE_TTL = 10
+# Responses kept with their ETag or Last-Modified for conditional requests.
+MAX_VALIDATORS = 1000
+
+
+class RateLimiter(object):
+    """
+    Token bucket shared by the fetch threads to keep their combined requests inside Reddit's API budget. The rate is
+    lowered to what Reddit's X-Ratelimit headers say is left of the current window, and requests wait for the window
+    to reset once none are left.
+    """
+    def __init__(self, rate=DEFAULT_RATE, burst=1):
+        """
+        :param rate: Requests allowed per second
+        :param burst: Requests allowed back to back after a quiet period
+        """
+        self.limit = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.time()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a request is allowed.
+        """
+        while True:
+            with self.lock:
+                now = time.time()
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def update(self, headers):
+        """
+        Spreads the requests left in Reddit's rate limit window over the time until it resets.
+        :param headers: Headers of a response from Reddit
+        """
+        try:
+            remaining = float(headers['x-ratelimit-remaining'])
+            reset = max(float(headers['x-ratelimit-reset']), 1)
+        except (KeyError, ValueError):
+            return
+
+        with self.lock:
+            if remaining < 1:
+                self.blocked_until = time.time() + reset
+                self.tokens = 0
+            self.rate = max(min(self.limit, remaining / reset), self.limit / 100)
+
+
+class ResponseCache(object):
+    """
+    Responses to listing requests shared by the fetchers: reused outright for a short time, and kept longer with their
+    ETag or Last-Modified date so that an unchanged listing can be answered with 304 Not Modified.
+    """
+    def __init__(self, ttl=CACHE_TTL, max_validators=MAX_VALIDATORS):
+        """
+        :param ttl: Seconds a response is reused without asking Reddit
+        :param max_validators: Responses kept for conditional requests, least recently used dropped first
+        """
+        self.ttl = ttl
+        self.max_validators = max_validators
+        self.fresh = {}
+        self.validators = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :return: The response cached for the request in the last ttl seconds, or None
+        """
+        with self.lock:
+            cached = self.fresh.get(key)
+            if cached and time.time() - cached[0] < self.ttl:
+                return cached[1]
+
+    def validator(self, key):
+        """
+        :return: (etag, last modified, response) of the last response to the request which had either, or None
+        """
+        with self.lock:
+            validator = self.validators.pop(key, None)
+            if validator:
+                self.validators[key] = validator
+            return validator
+
+    def put(self, key, response):
+        now = time.time()
+        with self.lock:
+            for stale in [stale for stale, (cached, _) in self.fresh.iteritems() if now - cached >= self.ttl]:
+                del self.fresh[stale]
+            self.fresh[key] = now, response
+
+            etag, modified = response.headers.get('etag'), response.headers.get('last-modified')
+            if etag or modified:
+                self.validators.pop(key, None)
+                self.validators[key] = etag, modified, response
+                while len(self.validators) > self.max_validators:
+                    self.validators.popitem(last=False)
+
+
+class Transport(DefaultHandler):
+    """
+    Praw handler which sends the requests through a pooled keep-alive session, paced by a rate limiter shared between
+    fetchers instead of praw's per-domain lock. Praw holds that lock for the whole request, so clients on different
+    threads would otherwise still download one listing at a time. Listing responses are cached and revalidated.
+    """
+    def __init__(self, limiter, cache=None, pool_size=10, metrics=None):
+        """
+        :param limiter: Rate limiter shared by the fetchers
+        :param cache: Response cache shared by the fetchers
+        :param pool_size: Connections kept open per host
+        :param metrics: Metrics the requests, cache hits and rate limit are recorded in
+        """
+        super(Transport, self).__init__()
+        self.limiter = limiter
+        self.cache = cache or ResponseCache()
+        self.metrics = metrics or Metrics()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.http.mount('https://', adapter)
+        self.http.mount('http://', adapter)
+
+    def request(self, request, proxies, timeout, verify, _cache_key=None, _cache_ignore=False, **_):
+        cacheable = request.method == 'GET' and _cache_key is not None and not _cache_ignore
+        validator = None
+        if cacheable:
+            response = self.cache.get(_cache_key)
+            if response is not None:
+                self.metrics.increment('http_cache_hits_total')
+                return response
+
+            validator = self.cache.validator(_cache_key)
+            if validator:
+                etag, modified, _ = validator
+                if etag:
+                    request.headers['If-None-Match'] = etag
+                if modified:
+                    request.headers['If-Modified-Since'] = modified
+
+        self.limiter.acquire()
+        settings = self.http.merge_environment_settings(request.url, proxies, False, verify, None)
+        response = self.http.send(request, timeout=timeout, allow_redirects=False, **settings)
+        self.limiter.update(response.headers)
+        self.metrics.increment('http_requests_total', status=response.status_code)
+        if 'x-ratelimit-remaining' in response.headers:
+            self.metrics.set('ratelimit_remaining', response.headers['x-ratelimit-remaining'])
+
+        if response.status_code == 304 and validator:
+            response = validator[2]
+        if cacheable and response.status_code == 200:
+            self.cache.put(_cache_key, response)
+        return response
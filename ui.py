@@ -1,15 +1,12 @@
-import pickle
-
 from PyQt5.QtWidgets import QMainWindow, QWidget, QStackedWidget, QLabel, QLineEdit, QSpacerItem, QPushButton, \
      QSizePolicy, QHBoxLayout, QVBoxLayout, QCheckBox, QMenu, QAction, QApplication
 from PyQt5.QtGui import QFont, QCursor, QDesktopServices
 from PyQt5.QtCore import QUrl, Qt
 
-from os import getcwd
-
 from request import RequestTable
 from log import LogViewer
 from threads import Worker
+import store
 
 
 class Posttid(QMainWindow):
@@ -40,7 +37,7 @@ class Posttid(QMainWindow):
         self.worker.missing_email_signal.connect(self.log.missing_email)
         self.worker.connect_signal.connect(self.log.connection)
         self.worker.reconnect_signal.connect(self.log.reconnect)
-        self.worker.request_signal.connect(self.log.request_found)
+        self.worker.event_signal.connect(self.log.log_event)
         self.worker.connectionerror_signal.connect(self.log.no_connection)
         self.worker.subreddit_noexist_signal.connect(self.log.subreddit_noexists)
         self.worker.status_condition_signal.connect(self.status_widget.set_status)
@@ -48,10 +45,11 @@ class Posttid(QMainWindow):
         self.worker.httperror_signal.connect(self.log.http)
         self.worker.test_inside_loop.connect(self.log.inside_loop)
         self.worker.test_query_requests.connect(self.log.query_requests)
+        self.worker.fetch_latency_signal.connect(self.log.fetch_latency)
         self.worker.start()
 
-        # Stop the worker thread when accessing the settings window
-        self.status_widget.settings.clicked.connect(self.worker.terminate)
+        # Pause the worker thread while the requests are edited in the settings window
+        self.status_widget.settings.clicked.connect(self.worker.pause)
 
     def set_up_window(self):
         """ Defines the features for the status window """
@@ -78,6 +76,11 @@ class Posttid(QMainWindow):
         self.settings_widget.settings_disable_checkbox.setChecked(self.status_widget.status_disable_checkbox
                                                                   .isChecked())
 
+    def closeEvent(self, event):
+        """ Stops the worker thread and delivers the emails still waiting to be sent before closing """
+        self.worker.stop(drain=True)
+        super(Posttid, self).closeEvent(event)
+
     def link(self, link_string):
         QDesktopServices.openUrl(QUrl(link_string))
 
@@ -87,14 +90,7 @@ class Posttid(QMainWindow):
         Load in saved email and requests on start.
         :return: dictionary containing saved data or null if no saved data
         """
-        try:
-            with open(getcwd() + '/tkl.pkl', 'rb') as f:
-                data = pickle.load(f)
-                email = data["email"]
-                requests = data["requests"]
-                return data, email, requests
-        except IOError:
-            return {}, "", {}
+        return store.load()
 
 
 class StatusWindow(QWidget):
@@ -163,11 +159,11 @@ class StatusWindow(QWidget):
         Called when the checkbox is marked to disable/enable the running program.
         """
         if self.status_disable_checkbox.isChecked():
-            self.parent.worker.disable = True
+            self.parent.worker.pause()
             self.log.disabled()
             self.set_status("Down", "red")
         else:
-            self.parent.worker.disable = False
+            self.parent.worker.resume()
             self.log.enabled()
             if self.parent.settings_widget.email_edit.text():
                 self.set_status("Up", "green")
@@ -286,14 +282,18 @@ class SettingsWindow(QWidget):
         request_table.inserted = {}
         request_table.removed = {}
 
-        self.parent.worker.start()
+        # The running worker picks up the new requests itself. It is only started when it is not running yet, such as
+        # when an email has just been entered.
+        if not self.parent.status_widget.status_disable_checkbox.isChecked():
+            self.parent.worker.resume()
+        if not self.parent.worker.isRunning():
+            self.parent.worker.start()
 
     @staticmethod
     def _save(email, requests):
         """
-        Save to external 'tkl.pkl' file in the current working directory.
-        :param email: Email to be saved by pickle
-        :param requests: Requests to be saved by pickle
+        Save to the 'posttid.db' store in the current working directory.
+        :param email: Email to be saved
+        :param requests: Requests to be saved
         """
-        with open(getcwd() + '/tkl.pkl', 'wb') as f:
-            pickle.dump(dict(email=email, requests=requests), f, pickle.HIGHEST_PROTOCOL)
\ No newline at end of file
+        store.save(email, requests)
\ No newline at end of file